@@ -19,6 +19,12 @@ const ResultSchema = new mongoose.Schema({
     type: [String],
     default: [],
   },
+  // Set while the explanation is still being written; the description is
+  // filled in when it arrives
+  explanationPending: {
+    type: Boolean,
+    default: false,
+  },
   createdAt: {
     type: Date,
     default: Date.now,
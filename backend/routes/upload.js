@@ -104,6 +104,8 @@ router.post(
         disease,
         description,
         disease_names,
+        explanationPending = false,
+        explanation,
       } = analysisResults;
 
       // Save results to the patient's record
@@ -115,10 +117,30 @@ router.post(
           disease,
           description,
           disease_names,
+          explanationPending,
         },
       });
 
       await patient.save();
+      const xrayId = patient.xrayImages[patient.xrayImages.length - 1]._id;
+
+      // Fill in the explanation once it arrives; the client polls
+      // /xray-result/:patientId/:xrayId for it
+      if (explanationPending) {
+        explanation
+          .then((finalResults) =>
+            Patient.updateOne(
+              { _id: patient._id, "xrayImages._id": xrayId },
+              {
+                $set: {
+                  "xrayImages.$.result.description": finalResults.description,
+                  "xrayImages.$.result.explanationPending": false,
+                },
+              }
+            )
+          )
+          .catch((err) => console.error("Error saving explanation:", err.message));
+      }
 
       // Get base URL for serving images
       const baseUrl = `${req.protocol}://${req.get("host")}`;
@@ -139,15 +161,46 @@ router.post(
           disease,
           description,
           disease_names,
+          xrayId,
+          explanationPending,
         },
       });
     } catch (err) {
       console.error("Error analyzing X-ray:", err.message);
+      // 503 when the inference queue is full, 504 when the job timed out
+      if (err.code === "QUEUE_FULL") {
+        res.set("Retry-After", "5");
+      }
       res
-        .status(500)
+        .status(err.statusCode || 500)
         .json({ message: "Failed to analyze X-ray: " + err.message });
     }
   }
 );
 
+// Analysis of one uploaded X-ray, polled while its explanation is pending
+router.get("/xray-result/:patientId/:xrayId", authMiddleware, async (req, res) => {
+  const { patientId, xrayId } = req.params;
+
+  try {
+    const patient = await Patient.findOne({
+      _id: patientId,
+      user: req.user.id,
+    });
+
+    const xray = patient && patient.xrayImages.id(xrayId);
+    if (!xray || !xray.result) {
+      return res.status(404).json({ message: "X-ray not found" });
+    }
+
+    const { disease, description, disease_names, explanationPending } = xray.result;
+    res.json({
+      result: { disease, description, disease_names, xrayId, explanationPending },
+    });
+  } catch (err) {
+    console.error(err.message);
+    res.status(500).json({ message: "Server error" });
+  }
+});
+
 export default router;
@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+
+import model_results as mr
+
+
+# -------------------- Memory Sampling --------------------
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux /proc, falls back to ru_maxrss)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        if mr.resource is None:
+            return 0.0
+        peak_rss = mr.resource.getrusage(mr.resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+class MemorySampler:
+    """Samples RSS on a background thread so each configuration gets its own peak"""
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+# -------------------- Inputs --------------------
+
+# Function to draw a synthetic chest X-ray (dark lung fields in a bright body outline)
+def synthetic_xray(size, seed):
+    rng = np.random.default_rng(seed)
+    h, w = size, int(size * rng.uniform(0.85, 1.0))
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    body = 0.75 - 0.35 * (((xx - w / 2) / (w / 2)) ** 2)
+    image = np.clip(body, 0, 1)
+    for side in (-1, 1):
+        cx, cy = w / 2 + side * w * 0.2, h * 0.45
+        lung = (((xx - cx) / (w * 0.15)) ** 2 + ((yy - cy) / (h * 0.3)) ** 2) < 1
+        image[lung] *= 0.35
+    image += rng.normal(0, 0.03, image.shape).astype(np.float32)
+    image = (np.clip(image, 0, 1) * 255).astype(np.uint8)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+# Function to write the benchmark inputs for one resolution and return their paths
+def prepare_inputs(work_dir, resolution, images_dir, count):
+    if images_dir and resolution == "native":
+        return mr.list_batch_inputs(images_dir)[:count]
+
+    out_dir = os.path.join(work_dir, str(resolution))
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    sources = mr.list_batch_inputs(images_dir)[:count] if images_dir else range(count)
+    for i, source in enumerate(sources):
+        if images_dir:
+            image = mr.read_image(source)
+            scale = int(resolution) / max(image.shape[:2])
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            image = synthetic_xray(2560 if resolution == "native" else int(resolution), i)
+        path = os.path.join(out_dir, f"xray_{i:04d}.png")
+        cv2.imwrite(path, image)
+        paths.append(path)
+    return paths
+
+# -------------------- Benchmark Modes --------------------
+
+# Function to run detection only (decode + preprocess + forward + NMS) on one batch
+def run_detect(heatmap, paths, work_dir):
+    heatmap.process_batch([mr.ImageContext(path) for path in paths], with_cam=False)
+
+# Function to run detection plus CAM on one batch
+def run_heatmap(heatmap, paths, work_dir):
+    heatmap.process_batch([mr.ImageContext(path) for path in paths], with_cam=True)
+
+# Function to run the full analyze_xray flow (stub explanations, no result cache) per image
+def run_pipeline(heatmap, paths, work_dir):
+    for i, path in enumerate(paths):
+        mr.analyze_xray(
+            path,
+            os.path.join(work_dir, f"yolo_{i}.png"),
+            os.path.join(work_dir, f"heatmap_{i}.png"),
+            heatmap.weight,
+        )
+
+# Runtime each reduced precision runs on
+PRECISION_BACKENDS = {
+    "bf16": "torch",
+    "int8": "onnx",
+}
+
+MODES = {
+    "detect": run_detect,
+    "heatmap": run_heatmap,
+    "pipeline": run_pipeline,
+}
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+# Function to benchmark one configuration
+def benchmark_config(model_path, mode, method, heatmap_mode, backend, precision, inputs, batch_size, threads, iterations, warmup, work_dir):
+    torch.set_num_threads(threads)
+    settings = {**mr.HEATMAP_SETTINGS, **mr.HEATMAP_MODES[heatmap_mode], "mode": heatmap_mode}
+    if heatmap_mode == "full":
+        settings["method"] = method
+    if mode == "pipeline":
+        mr.configure_detector(backend, precision)
+        mr.configure_heatmap(heatmap_mode)
+        heatmap = mr.get_heatmap_model(model_path)
+    else:
+        heatmap = mr.yolov8_heatmap(weight=model_path, backend=backend, precision=precision, **settings)
+    run_batch = MODES[mode]
+    batches = [inputs[i:i + batch_size] for i in range(0, len(inputs), batch_size)]
+
+    for i in range(warmup):
+        run_batch(heatmap, batches[i % len(batches)], work_dir)
+
+    latencies = []
+    images = 0
+    with MemorySampler() as memory:
+        started = time.perf_counter()
+        for i in range(iterations):
+            batch = batches[i % len(batches)]
+            start = time.perf_counter()
+            run_batch(heatmap, batch, work_dir)
+            latencies.append((time.perf_counter() - start) * 1000)
+            images += len(batch)
+        elapsed = time.perf_counter() - started
+
+    if mode != "pipeline":
+        heatmap.release()
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "mean_ms": round(float(np.mean(latencies)), 2),
+        "throughput_ips": round(images / elapsed, 3) if elapsed > 0 else 0.0,
+        "peak_rss_mb": round(memory.peak, 1),
+        # Earlier configurations leave the process RSS high, so also report the growth
+        "peak_rss_growth_mb": round(memory.peak - memory.start, 1),
+    }
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "cuda": torch.cuda.is_available(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the detection + heatmap pipeline')
+    parser.add_argument('--model', type=str, action='append', help='Checkpoint to benchmark (repeat to compare, e.g. YOLOv8n and YOLOv8s)')
+    parser.add_argument('--images', type=str, default='', help='Directory of sample X-rays (default: synthetic images)')
+    parser.add_argument('--num-images', type=int, default=8, help='Number of images per resolution')
+    parser.add_argument('--resolutions', type=str, nargs='+', default=['native', '1024'], help='Input long sides in px, or "native" (raw 2-3k px)')
+    parser.add_argument('--modes', type=str, nargs='+', default=['detect', 'heatmap', 'pipeline'], choices=list(MODES))
+    parser.add_argument('--methods', type=str, nargs='+', default=['EigenGradCAM', 'EigenCAM', 'GradCAM', 'HiResCAM'], help='CAM methods for the heatmap mode')
+    parser.add_argument('--heatmap-modes', type=str, nargs='+', default=['full'], choices=list(mr.HEATMAP_MODES), help='Heatmap modes for the heatmap and pipeline modes (--methods only applies to full)')
+    parser.add_argument('--backends', type=str, nargs='+', default=['torch'], choices=['torch', 'onnx', 'openvino'], help='Detection runtimes to compare')
+    parser.add_argument('--precisions', type=str, nargs='+', default=['fp32'], choices=['fp32', 'bf16', 'int8'], help='Detection precisions to compare (bf16 runs on torch, int8 on onnx)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--threads', type=int, nargs='+', default=[torch.get_num_threads()])
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--output', type=str, default='', help='Path to save the JSON report')
+    args = parser.parse_args()
+    if not args.model:
+        args.model = [os.path.join(os.path.dirname(__file__), "best.pt")]
+    return args
+
+def main():
+    args = parse_args()
+    # Explanations are stubbed so the numbers do not depend on the network
+    mr.configure_explanations("stub")
+
+    report = {"environment": environment(), "results": []}
+    with tempfile.TemporaryDirectory(prefix="xray-bench-") as work_dir:
+        for resolution in args.resolutions:
+            inputs = prepare_inputs(work_dir, resolution, args.images, args.num_images)
+            for model_path in args.model:
+                for mode in args.modes:
+                    # Only the full heatmap of the heatmap mode depends on the CAM method
+                    variants = [
+                        (heatmap_mode, method)
+                        for heatmap_mode in (args.heatmap_modes if mode != "detect" else ["full"])
+                        for method in (args.methods if mode == "heatmap" and heatmap_mode == "full"
+                                       else [mr.HEATMAP_MODES[heatmap_mode].get("method", "")])
+                    ]
+                    # The pipeline runs one image at a time
+                    batch_sizes = [1] if mode == "pipeline" else args.batch_sizes
+                    # Reduced precisions only exist on one runtime each
+                    runtimes = [
+                        (backend, precision)
+                        for backend in args.backends
+                        for precision in args.precisions
+                        if precision == "fp32" or PRECISION_BACKENDS[precision] == backend
+                    ]
+                    for heatmap_mode, method in variants:
+                        for backend, precision in runtimes:
+                            for batch_size in batch_sizes:
+                                for threads in args.threads:
+                                    config = {
+                                        "model": os.path.basename(model_path),
+                                        "mode": mode,
+                                        "resolution": resolution,
+                                        "backend": backend,
+                                        "precision": precision,
+                                        "batch_size": batch_size,
+                                        "threads": threads,
+                                        "heatmap_mode": heatmap_mode,
+                                        "method": method,
+                                    }
+                                    metrics = benchmark_config(
+                                        model_path, mode, method, heatmap_mode, backend, precision, inputs, batch_size,
+                                        threads, args.iterations, args.warmup, work_dir)
+                                    report["results"].append({**config, **metrics})
+                                    print(json.dumps(report["results"][-1]), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+from pytorch_grad_cam.utils.svd_on_activations import get_2d_projection as full_svd_projection
+from ultralytics.utils.ops import xywh2xyxy
+
+import benchmark
+import model_results as mr
+
+
+# -------------------- Loop Implementations --------------------
+# The per-anchor Python versions the vectorized code replaced, kept as the baseline
+
+def loop_post_process(result, index=0):
+    logits_ = result[:, 4:]
+    boxes_ = result[:, :4]
+    sorted, indices = torch.sort(logits_.max(1)[0], descending=True)
+    return torch.transpose(logits_[index], dim0=0, dim1=1)[indices[index]], torch.transpose(boxes_[index], dim0=0, dim1=1)[
+        indices[index]], xywh2xyxy(torch.transpose(boxes_[index], dim0=0, dim1=1)[indices[index]]).cpu().detach().numpy()
+
+class loop_target(torch.nn.Module):
+    def __init__(self, ouput_type, conf, ratio) -> None:
+        super().__init__()
+        self.ouput_type = ouput_type
+        self.conf = conf
+        self.ratio = ratio
+
+    def forward(self, data):
+        post_result, pre_post_boxes = data
+        result = []
+        for i in range(post_result.size(0)):
+            if float(post_result[i].max()) >= self.conf:
+                if self.ouput_type == 'class' or self.ouput_type == 'all':
+                    result.append(post_result[i].max())
+                if self.ouput_type == 'box' or self.ouput_type == 'all':
+                    for j in range(4):
+                        result.append(pre_post_boxes[i, j])
+        return sum(result)
+
+# -------------------- Benchmark --------------------
+
+# Function to time the CAM stages (post-processing, target, backward, CAM) on one batch
+def time_cam(heatmap, tensor, iterations):
+    latencies = []
+    cams = None
+    for _ in range(iterations):
+        heatmap.enable_gradients()
+        outputs = heatmap.extractor(tensor)
+        start = time.perf_counter()
+        # Post-processing runs inside the forward call, so time it separately
+        for index in range(tensor.size(0)):
+            heatmap.extractor.post_process(heatmap.extractor.raw_output, index)
+        cams = heatmap.compute_cam(tensor, outputs)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, cams
+
+def benchmark_method(model_path, method, tensor, iterations):
+    heatmap = mr.yolov8_heatmap(weight=model_path, **{**mr.HEATMAP_SETTINGS, "method": method})
+    extractor = heatmap.extractor
+    if method in mr.GRADIENT_FREE_CAM_METHODS:
+        # compute_cam builds no target and runs no backward pass for these, so
+        # the loop and vectorized targets would only time the same code twice
+        latencies, _ = time_cam(heatmap, tensor, iterations)
+        extractor.release()
+        return {"cam_ms": round(float(np.median(latencies)), 2), "target_comparison": "not applicable (gradient-free)"}
+    results = {}
+    cams = {}
+    for variant in ("loop", "vectorized"):
+        if variant == "loop":
+            extractor.post_process = lambda result, index=0: loop_post_process(result, index)[:2]
+            heatmap.target = loop_target(heatmap.backward_type, heatmap.conf_threshold, heatmap.ratio)
+        else:
+            del extractor.post_process
+            heatmap.target = mr.yolov8_target(heatmap.backward_type, heatmap.conf_threshold, heatmap.ratio)
+        latencies, cams[variant] = time_cam(heatmap, tensor, iterations)
+        results[f"{variant}_ms"] = round(float(np.median(latencies)), 2)
+    extractor.release()
+    results["speedup"] = round(results["loop_ms"] / max(results["vectorized_ms"], 1e-6), 2)
+    results["max_cam_diff"] = float(np.abs(cams["loop"] - cams["vectorized"]).max())
+    return results
+
+# Function to time the Eigen projection with the library's full SVD and with the thin one
+def benchmark_projection(model_path, tensor, iterations):
+    heatmap = mr.yolov8_heatmap(weight=model_path, **{**mr.HEATMAP_SETTINGS, "method": "EigenCAM"})
+    extractor = heatmap.extractor
+    with torch.no_grad():
+        extractor(tensor)
+    activations = [a.numpy() for a in extractor.activations]
+    extractor.release()
+    results = {}
+    projections = {}
+    for variant, project in (("full_svd", full_svd_projection), ("thin_svd", mr.get_2d_projection)):
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            projections[variant] = [project(a.copy()) for a in activations]
+            latencies.append((time.perf_counter() - start) * 1000)
+        results[f"{variant}_ms"] = round(float(np.median(latencies)), 2)
+    results["speedup"] = round(results["full_svd_ms"] / max(results["thin_svd_ms"], 1e-6), 2)
+    # The sign of a singular vector is arbitrary, so compare magnitudes
+    results["max_projection_diff"] = max(
+        float(np.abs(np.abs(full) - np.abs(thin)).max())
+        for full, thin in zip(projections["full_svd"], projections["thin_svd"]))
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the CAM target (per-anchor loop vs tensor ops) per gradient-based CAM method, and of the Eigen projection')
+    parser.add_argument('--model', type=str, default=os.path.join(os.path.dirname(__file__), "best.pt"))
+    parser.add_argument('--input', type=str, default='', help='X-ray to run on (default: a synthetic image)')
+    parser.add_argument('--methods', type=str, nargs='+', default=['EigenGradCAM', 'EigenCAM', 'GradCAM', 'GradCAMPlusPlus', 'HiResCAM', 'LayerCAM', 'XGradCAM'])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--projection', action='store_true', help='Also time the Eigen SVD projection (full vs thin)')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--output', type=str, default='', help='Path to save the JSON report')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.input:
+        context = mr.ImageContext(args.input)
+    else:
+        context = mr.ImageContext.from_rgb(benchmark.synthetic_xray(1024, 0))
+    imgsz = mr.get_heatmap_model(args.model).imgsz
+    tensor = torch.stack([context.tensor(imgsz)] * args.batch_size)
+
+    report = {"model": os.path.basename(args.model), "imgsz": imgsz, "batch_size": args.batch_size, "results": []}
+    if args.projection:
+        report["projection"] = benchmark_projection(args.model, tensor, args.iterations)
+        print(json.dumps({"projection": report["projection"]}))
+    for method in args.methods:
+        report["results"].append({"method": method, **benchmark_method(args.model, method, tensor, args.iterations)})
+        print(json.dumps(report["results"][-1]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
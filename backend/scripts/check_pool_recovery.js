@@ -0,0 +1,66 @@
+// Checks that a pool slot comes back after a job hangs on its worker: a fake
+// worker that never answers "hang" jobs holds the only slot, the job times
+// out, the pool kills the worker and the job queued behind it runs on a new
+// one. Exits with code 1 when the slot stays taken.
+//
+//   cd backend && node scripts/check_pool_recovery.js [timeoutMs]
+import { spawn } from "child_process";
+import { InferencePool, InferenceWorker } from "../utils/yoloInference.js";
+
+const TIMEOUT_MS = parseInt(process.argv[2] || "1000", 10);
+
+// Speaks the model_results.py --worker protocol without loading a model
+const FAKE_WORKER = `
+const lines = require("readline").createInterface({ input: process.stdin });
+console.log(JSON.stringify({ type: "ready", pid: process.pid }));
+lines.on("line", (line) => {
+  const job = JSON.parse(line);
+  if (job.input === "hang") {
+    return; // like a forward pass that never returns
+  }
+  const result = { disease: "No Finding", description: "", disease_names: [] };
+  console.log(JSON.stringify({ id: job.id, ok: true, result }));
+});
+`;
+
+class FakeWorker extends InferenceWorker {
+  spawnProcess() {
+    return spawn(process.execPath, ["-e", FAKE_WORKER]);
+  }
+}
+
+const slot = { args: [], cpus: null, threads: 1, running: 0, capacity: 1, worker: new FakeWorker(1) };
+const pool = new InferencePool([slot], 4, TIMEOUT_MS);
+const submit = (input) =>
+  pool.run((slot, deadline) => slot.worker.run({ input, deadline })).then(
+    () => "ok",
+    (error) => error.code || error.message
+  );
+
+const hung = submit("hang");
+await new Promise((resolve) => setTimeout(resolve, TIMEOUT_MS / 2));
+const firstPid = slot.worker.placement.pid;
+// Queued behind the hung job, with half its deadline left when that one expires
+const queued = submit("fast");
+
+const outcomes = { hung: await hung, queued: await queued };
+const after = { outcome: await submit("fast"), pid: slot.worker.placement.pid };
+const metrics = pool.metrics();
+const report = {
+  outcomes: { ...outcomes, after: after.outcome },
+  workerReplaced: after.pid !== firstPid,
+  running: metrics.running,
+  counters: {
+    completed: metrics.completed,
+    failed: metrics.failed,
+    timedOut: metrics.timedOut,
+    workersKilled: metrics.workersKilled,
+  },
+};
+console.log(JSON.stringify(report, null, 2));
+
+slot.worker.kill(new Error("Check finished"));
+const recovered =
+  outcomes.hung === "TIMEOUT" && outcomes.queued === "ok" && after.outcome === "ok" &&
+  report.workerReplaced && metrics.running === 0;
+process.exit(recovered ? 0 : 1);
@@ -1,22 +1,38 @@
+import time
+# Start of the module-level imports, for the import-time report
+_import_started = time.perf_counter()
 import torch
+import torchvision
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 import argparse
+import importlib
 import os
 import sys
 import json
+import asyncio
+import contextvars
+import functools
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 from ultralytics import YOLO
-from PIL import Image
-from io import BytesIO
 import base64
 from typing import List, Optional, Tuple, Union, Dict, Any
-from pytorch_grad_cam import (EigenCAM, EigenGradCAM, GradCAM, GradCAMPlusPlus,
-                             HiResCAM, LayerCAM, RandomCAM, XGradCAM)
-from pytorch_grad_cam.utils.image import scale_cam_image, show_cam_on_image
-from ultralytics.nn.tasks import attempt_load_weights
-from ultralytics.utils.ops import non_max_suppression, xywh2xyxy
-from openai import OpenAI
+from ultralytics.engine.results import Results
+from ultralytics.nn.autobackend import AutoBackend
+from ultralytics.utils.metrics import box_iou, compute_ap
+from ultralytics.utils.ops import non_max_suppression, scale_boxes
+try:
+    import fcntl  # Locks the shared explanation cache file (not on Windows)
+except ImportError:
+    fcntl = None
+# pytorch_grad_cam, openai and pydicom are imported by the stage that needs
+# them (see lazy_import), so an X-ray without findings never loads the first two
 
 
 # Check if OpenAI is available and configured
@@ -33,8 +49,127 @@ from openai import OpenAI
 # except ImportError:
 #     HAS_OPENAI = False
 
-client = OpenAI(api_key="")
 
+# -------------------- Stage Timing --------------------
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+class StageTimer:
+    """Accumulates wall-clock time per pipeline stage for one request (or batch)"""
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            stages_ms = {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+        report = {
+            "stages_ms": stages_ms,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "torch_num_threads": torch.get_num_threads(),
+            "torch_num_interop_threads": torch.get_num_interop_threads(),
+        }
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report["peak_rss_mb"] = round(peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+        return report
+
+# Timer of the request being processed on the current thread, if any
+_current_timer = contextvars.ContextVar("stage_timer", default=None)
+# Set while torch.profiler is recording so stages show up as labelled ranges
+_record_functions = False
+
+@contextmanager
+def timed(name, timer=None):
+    """Add the time spent in the block to the current request's timer under `name`"""
+    timer = timer or _current_timer.get()
+    start = time.perf_counter()
+    try:
+        if _record_functions:
+            with torch.profiler.record_function(name):
+                yield
+        else:
+            yield
+    finally:
+        if timer is not None:
+            timer.add(name, time.perf_counter() - start)
+
+# -------------------- Lazy Imports --------------------
+
+# Seconds spent importing, per stage: "core" for the module-level imports above
+# and one entry for each stage that imports its dependencies on first use
+IMPORT_TIMES = OrderedDict(core=time.perf_counter() - _import_started)
+
+# Function to import a module the first time a stage needs it
+def lazy_import(name, stage):
+    """The time of the first import goes to IMPORT_TIMES and to the current request's timer"""
+    if name in sys.modules:
+        return importlib.import_module(name)
+    start = time.perf_counter()
+    with timed(f"import_{stage}"):
+        module = importlib.import_module(name)
+    IMPORT_TIMES[stage] = IMPORT_TIMES.get(stage, 0.0) + time.perf_counter() - start
+    return module
+
+def import_report():
+    """Cold-start import time per stage in milliseconds"""
+    report = {stage: round(seconds * 1000, 1) for stage, seconds in IMPORT_TIMES.items()}
+    report["total"] = round(sum(IMPORT_TIMES.values()) * 1000, 1)
+    return report
+
+# -------------------- CPU Placement --------------------
+
+# Function to parse a CPU list such as "0-3,8" into sorted core ids
+def parse_cpu_list(spec):
+    cpus = set()
+    try:
+        for part in filter(None, (part.strip() for part in spec.split(","))):
+            first, _, last = part.partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid CPU list {spec!r}")
+    if not cpus:
+        raise argparse.ArgumentTypeError("the CPU list is empty")
+    return sorted(cpus)
+
+# Function to pin the process to a set of cores and size the thread pools to them
+def configure_threads(threads=None, cpus=None):
+    """
+    Several workers on one host each get their own cores this way instead of
+    every torch/OpenCV pool spreading over all of them. threads defaults to
+    one per pinned core; without either the library defaults are kept.
+    """
+    if cpus:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        else:
+            print("Warning: CPU pinning is not supported on this platform", file=sys.stderr)
+    threads = threads or (len(cpus) if cpus else None)
+    if not threads:
+        return
+    torch.set_num_threads(threads)
+    try:
+        # The detector has no independent branches to run side by side
+        torch.set_num_interop_threads(1)
+    except RuntimeError:  # only settable before the first parallel op
+        pass
+    cv2.setNumThreads(threads)
+
+# Function to describe where the process runs, for the worker's ready message
+def thread_placement():
+    placement = {"pid": os.getpid(), "threads": torch.get_num_threads()}
+    if hasattr(os, "sched_getaffinity"):
+        placement["cpus"] = sorted(os.sched_getaffinity(0))
+    return placement
 
 # -------------------- Utils Functions --------------------
 
@@ -73,66 +208,507 @@ def letterbox(
         im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
     top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
     left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
-    im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
+    if top or bottom or left or right:  # copyMakeBorder copies even without a border
+        im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
     
     return im, ratio, (dw, dh)
 
+# -------------------- Image Decoding --------------------
+
+# Extensions decoded through pydicom instead of OpenCV
+DICOM_EXTENSIONS = ('.dicom', '.dcm')
+
+# How DICOM pixels are mapped to 8 bits (see configure_decoding); also part of
+# the result cache key
+DECODE_SETTINGS = {
+    "dicom_windowing": "max",
+}
+
+def configure_decoding(dicom_windowing="max"):
+    DECODE_SETTINGS["dicom_windowing"] = dicom_windowing
+
+def dicom_pixels(ds, image_path):
+    """
+    Stored pixel values of a single-frame DICOM. Uncompressed little endian
+    data is memory-mapped straight from the file, so nothing is copied until
+    it is downscaled; anything else goes through pydicom's decoders.
+    """
+    # Without reading the deferred value, so the element still points into the file
+    element = ds.get_item("PixelData", keep_deferred=True)
+    transfer_syntax = ds.file_meta.get("TransferSyntaxUID")
+    mappable = (
+        element is not None
+        and getattr(element, "value", b"") is None
+        and transfer_syntax is not None
+        and not transfer_syntax.is_compressed
+        and transfer_syntax.is_little_endian
+        and int(ds.get("NumberOfFrames", 1) or 1) == 1
+        and ds.get("SamplesPerPixel", 1) == 1
+        and ds.get("PixelRepresentation", 0) == 0
+        and ds.BitsAllocated in (8, 16)
+    )
+    if not mappable:
+        return ds.pixel_array
+    dtype = np.dtype(f"<u{ds.BitsAllocated // 8}")
+    pixels = np.memmap(image_path, dtype=dtype, mode='r', offset=element.value_tell,
+                       shape=(ds.Rows, ds.Columns))
+    # Bits above BitsStored may hold overlays and are not part of the pixel
+    # value; masking copies the image, so only do it when they are set
+    bits_stored = ds.get("BitsStored", ds.BitsAllocated)
+    if bits_stored < ds.BitsAllocated and int(pixels.max()) >> bits_stored:
+        pixels = pixels & dtype.type((1 << bits_stored) - 1)
+    return pixels
+
+def read_dicom(image_path, max_side=None):
+    """
+    Decode a DICOM study to 8-bit BGR with its long side downscaled to at most
+    max_side. The downscale happens on the stored values before any float
+    conversion, so windowing only touches the small image. With "max"
+    windowing pixels are divided by their maximum like dicom_to_png does for
+    the training data; "voi" applies the modality LUT, the VOI LUT / window
+    from the header and inverts MONOCHROME1.
+    """
+    try:
+        pydicom = lazy_import("pydicom", "dicom")
+    except ImportError:
+        raise ImportError("pydicom is required for DICOM input")
+    # Large elements (the pixel data) are only read when accessed
+    ds = pydicom.dcmread(image_path, defer_size="1 KB")
+    pixels = dicom_pixels(ds, image_path)
+    peak = float(pixels.max())
+    
+    height, width = pixels.shape[:2]
+    scale = min(1.0, max_side / max(height, width)) if max_side else 1.0
+    if scale < 1.0:
+        pixels = cv2.resize(pixels, (round(width * scale), round(height * scale)),
+                            interpolation=cv2.INTER_AREA)
+    else:
+        pixels = np.asarray(pixels)
+    
+    if DECODE_SETTINGS["dicom_windowing"] == "voi":
+        pixel_luts = lazy_import("pydicom.pixels", "dicom")
+        image = pixel_luts.apply_voi_lut(pixel_luts.apply_modality_lut(pixels, ds), ds).astype(np.float32)
+        low, high = float(image.min()), float(image.max())
+        image = (image - low) * (255.0 / (high - low)) if high > low else np.zeros_like(image)
+        if ds.get("PhotometricInterpretation") == "MONOCHROME1":
+            image = 255.0 - image
+    else:
+        image = pixels.astype(np.float32) * (255.0 / peak) if peak > 0 else np.zeros(pixels.shape, np.float32)
+    return cv2.cvtColor(image.astype(np.uint8), cv2.COLOR_GRAY2BGR)
+
+# Function to decode an image file to 8-bit BGR
+def read_image(image_path, max_side=None):
+    """cv2.imread for regular images; DICOM studies are decoded (and downscaled to max_side) directly"""
+    if image_path.lower().endswith(DICOM_EXTENSIONS):
+        try:
+            return read_dicom(image_path, max_side)
+        except Exception as e:
+            print(f"Error: Could not decode DICOM {image_path}: {str(e)}")
+            return None
+    return cv2.imread(image_path)
+
+# -------------------- Image Context --------------------
+
+class ImageContext:
+    """
+    One input image for the duration of a request. The file is decoded once
+    and every stage takes what it needs from here; the derived arrays are
+    computed on first use and cached:
+    - original: the decoded BGR image (DICOM already downscaled)
+    - rgb: the target_size RGB resize the detector and the overlays use
+    - tensor(imgsz): the letterboxed [3, imgsz, imgsz] float tensor in [0, 1]
+    triage and cascade hold the verdicts of the triage classifier and the
+    detector cascade once they have run (see triage_batch and detect_batch).
+    """
+    def __init__(self, path: Optional[str], target_size=(1024, 1024)) -> None:
+        self.path = path
+        self.target_size = target_size
+        self.triage = None
+        self.cascade = None
+        self._original = None
+        self._rgb = None
+        self._tensors = {}
+        self._decoded = False
+
+    @classmethod
+    def from_rgb(cls, image_rgb: np.ndarray, path: Optional[str] = None) -> "ImageContext":
+        """Wrap an RGB array that is already at the detector resolution"""
+        context = cls(path, image_rgb.shape[1::-1])
+        context._rgb = image_rgb
+        # A contiguous copy, not a reversed view, like the decoded image of a file
+        context._original = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+        context._decoded = True
+        return context
+
+    @property
+    def original(self) -> Optional[np.ndarray]:
+        """The decoded BGR image, or None when the file could not be read"""
+        if not self._decoded:
+            self._decoded = True
+            with timed("decode"):
+                # DICOM is downscaled while decoding, there is no point in going past target_size
+                self._original = read_image(self.path, max(self.target_size))
+            if self._original is None:
+                print(f"Error: Could not load image from {self.path}")
+        return self._original
+
+    @property
+    def rgb(self) -> Optional[np.ndarray]:
+        if self._rgb is None and self.original is not None:
+            with timed("preprocess"):
+                # Resize to target size
+                resized = cv2.resize(self.original, self.target_size, interpolation=cv2.INTER_LINEAR)
+                # Convert to RGB in place (YOLO expects RGB images)
+                self._rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=resized)
+        return self._rgb
+
+    def tensor(self, imgsz: int) -> torch.Tensor:
+        """Letterboxed CHW float tensor; a view of it doubles as the HWC image for the CAM overlay"""
+        if imgsz not in self._tensors:
+            with timed("letterbox"):
+                # Fixed-size letterbox so every image stacks into the same batch
+                image = letterbox(self.rgb, new_shape=imgsz, auto=False)[0]
+                # One float copy, normalized in place
+                tensor = torch.from_numpy(image).permute(2, 0, 1).to(
+                    torch.float32, memory_format=torch.contiguous_format)
+                self._tensors[imgsz] = tensor.div_(255.0)
+        return self._tensors[imgsz]
+
+    def original_boxes(self, boxes: List[List[float]]) -> List[List[float]]:
+        """Map [x1, y1, x2, y2] boxes from the rgb resize to the original image"""
+        scale_y = self.original.shape[0] / self.rgb.shape[0]
+        scale_x = self.original.shape[1] / self.rgb.shape[1]
+        return [[x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y] for x1, y1, x2, y2 in boxes]
+
+# Function to wrap an image path or RGB array in an ImageContext
+def image_context(image):
+    if isinstance(image, ImageContext):
+        return image
+    if isinstance(image, str):
+        return ImageContext(image)
+    return ImageContext.from_rgb(image)
+
+# -------------------- Model Registry --------------------
+
+class ModelRegistry:
+    """
+    Deserializes each checkpoint once and keeps it in memory keyed by path and
+    mtime, so the detector and the CAM wrapper share the same module.
+    """
+    def __init__(self) -> None:
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def key(self, weight: str) -> Tuple[str, float]:
+        path = os.path.abspath(weight)
+        return path, os.path.getmtime(path)
+
+    def get(self, weight: str) -> YOLO:
+        key = self.key(weight)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                # Drop stale entries for a checkpoint that changed on disk
+                for stale in [k for k in self._models if k[0] == key[0]]:
+                    del self._models[stale]
+                model = YOLO(key[0])
+                # The checkpoint dict (train args, and the EMA and optimizer state
+                # of unstripped checkpoints) is only needed to save or resume training
+                model.ckpt = {}
+                self._models[key] = model
+            return model
+
+model_registry = ModelRegistry()
+
+# -------------------- Exported Runtimes --------------------
+
+# ultralytics export format and the suffix it gives the exported file/directory
+EXPORT_FORMATS = {
+    "onnx": ("onnx", ".onnx"),
+    "openvino": ("openvino", "_openvino_model"),
+}
+
+_export_lock = threading.Lock()
+
+def export_model(model_path, backend, imgsz):
+    """
+    Export the checkpoint for an ONNX Runtime / OpenVINO backend and return the
+    exported path. The export is written next to the checkpoint once and only
+    redone when the checkpoint is newer than it.
+    """
+    export_format, suffix = EXPORT_FORMATS[backend]
+    exported = os.path.splitext(os.path.abspath(model_path))[0] + suffix
+    with _export_lock:
+        if not os.path.exists(exported) or os.path.getmtime(exported) < os.path.getmtime(model_path):
+            print(f"Exporting {model_path} for {backend}, this only happens once")
+            # Export from a fresh copy since exporting fuses the model it runs on.
+            # Dynamic axes so batches of any size go through the same graph
+            YOLO(model_path).export(format=export_format, imgsz=imgsz, dynamic=True)
+    return exported
+
+def quantized_model_path(model_path):
+    return os.path.splitext(os.path.abspath(model_path))[0] + ".int8.onnx"
+
+def quantize_model(model_path, imgsz, calibration_paths):
+    """
+    Statically quantize the ONNX export to INT8 with activation ranges
+    calibrated on calibration_paths and cache it next to the checkpoint as
+    <name>.int8.onnx. Only the convolutions are quantized (QDQ, per-channel
+    weights); the box decoding of the head stays in float.
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class CalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(calibration_paths)
+
+        def get_next(self):
+            for path in self.paths:
+                context = ImageContext(path)
+                if context.rgb is not None:
+                    return {"images": context.tensor(imgsz)[None].numpy()}
+            return None
+
+    exported = export_model(model_path, "onnx", imgsz)
+    output_path = quantized_model_path(model_path)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        preprocessed = os.path.join(tmp_dir, "preprocessed.onnx")
+        # Symbolic shape inference does not get through the dynamic axes of the export
+        quant_pre_process(exported, preprocessed, skip_symbolic_shape=True)
+        quantize_static(
+            preprocessed, output_path, CalibrationReader(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            op_types_to_quantize=["Conv"],
+        )
+    return output_path
+
+class Bfloat16Detector:
+    """Detection forward pass of the torch module under bfloat16 autocast"""
+    def __init__(self, model: torch.nn.Module) -> None:
+        self.model = model
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad(), torch.autocast(tensor.device.type, dtype=torch.bfloat16):
+            return self.model(tensor)[0].float()
+
+def load_detector(model_path, backend, precision, imgsz, device, model):
+    """
+    Forward-only detector for the backend and precision, returning the raw
+    [B, 4 + nc, N] predictions. None for fp32 torch, where the forward pass
+    of the CAM is reused for detection.
+    """
+    if precision == "int8":
+        path = quantized_model_path(model_path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f"No INT8 model at {path}, create it with --validate-precision --precision int8")
+        return AutoBackend(path, device=device, fp16=False)
+    if precision == "bf16":
+        return Bfloat16Detector(model)
+    if backend == "torch":
+        return None
+    return AutoBackend(export_model(model_path, backend, imgsz), device=device, fp16=False)
+
+# -------------------- Result Cache --------------------
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    On-disk cache of analysis results keyed by the image bytes, the checkpoint
+    and the heatmap settings. Each entry is a directory holding result.json
+    and the two overlay PNGs; entries are evicted least recently used first
+    once the cache grows past max_bytes.
+    """
+    RESULT_FILE = "result.json"
+    YOLO_FILE = "yolo.png"
+    HEATMAP_FILE = "heatmap.png"
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._checkpoint_hashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def checkpoint_hash(self, model_path: str) -> str:
+        # Hashing the checkpoint is not free, so remember it per path/mtime/size
+        stat = os.stat(model_path)
+        key = (os.path.abspath(model_path), stat.st_mtime, stat.st_size)
+        if key not in self._checkpoint_hashes:
+            self._checkpoint_hashes[key] = hash_file(model_path)
+        return self._checkpoint_hashes[key]
+
+    def key(self, input_path: str, model_path: str, settings: Dict[str, Any]) -> str:
+        digest = hashlib.sha256()
+        digest.update(hash_file(input_path).encode())
+        digest.update(self.checkpoint_hash(model_path).encode())
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str, yolo_output: str, heatmap_output: str) -> Optional[Dict[str, Any]]:
+        """Copy the cached overlays to the output paths and return the cached result, or None"""
+        entry = os.path.join(self.cache_dir, key)
+        result_path = os.path.join(entry, self.RESULT_FILE)
+        try:
+            with open(result_path) as f:
+                results = json.load(f)
+            shutil.copyfile(os.path.join(entry, self.YOLO_FILE), yolo_output)
+            heatmap_path = os.path.join(entry, self.HEATMAP_FILE)
+            if os.path.isfile(heatmap_path):
+                shutil.copyfile(heatmap_path, heatmap_output)
+            # Mark as recently used
+            os.utime(result_path)
+        except (OSError, ValueError):
+            return None
+        return results
+
+    def put(self, key: str, results: Dict[str, Any], yolo_output: str, heatmap_output: str) -> None:
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry):
+            return
+        # Build the entry in a temporary directory and move it into place so
+        # concurrent readers never see a partial entry
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            shutil.copyfile(yolo_output, os.path.join(tmp_dir, self.YOLO_FILE))
+            if os.path.isfile(heatmap_output):
+                shutil.copyfile(heatmap_output, os.path.join(tmp_dir, self.HEATMAP_FILE))
+            with open(os.path.join(tmp_dir, self.RESULT_FILE), 'w') as f:
+                json.dump(results, f)
+            os.rename(tmp_dir, entry)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                entry = os.path.join(self.cache_dir, name)
+                result_path = os.path.join(entry, self.RESULT_FILE)
+                if name.startswith(".") or not os.path.isfile(result_path):
+                    continue
+                size = sum(
+                    os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(result_path), size, entry))
+                total += size
+            for _, size, entry in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
 # -------------------- Custom ActivationsAndGradients Class --------------------
 
 class ActivationsAndGradients:
-    """ Class for extracting activations and registering gradients from targetted intermediate layers """
+    """
+    Class for extracting activations and registering gradients from targetted intermediate layers.
+    One forward hook per layer stays registered until release(); every call
+    copies the activations and gradients into per-layer CPU buffers that are
+    reused while the input shape stays the same, and clear() drops the rest
+    of the call's state so nothing grows across requests.
+    """
     def __init__(self, model: torch.nn.Module,
                  target_layers: List[torch.nn.Module],
                  reshape_transform: Optional[callable]) -> None:  # type: ignore
         self.model = model
-        self.gradients = []
-        self.activations = []
+        self.raw_output = None
         self.reshape_transform = reshape_transform
-        self.handles = []
-        for target_layer in target_layers:
-            self.handles.append(
-                target_layer.register_forward_hook(self.save_activation))
-            self.handles.append(
-                target_layer.register_forward_hook(self.save_gradient))
+        # Only record while the CAM forward pass runs; the module is shared
+        # with the detector, whose forward passes must not fill the buffers
+        self.recording = False
+        self.activation_buffers = [None] * len(target_layers)
+        self.gradient_buffers = [None] * len(target_layers)
+        self._activations = [None] * len(target_layers)
+        self._gradients = [None] * len(target_layers)
+        self.handles = [
+            target_layer.register_forward_hook(functools.partial(self.save_activation, index))
+            for index, target_layer in enumerate(target_layers)
+        ]
 
-    def save_activation(self, module: torch.nn.Module,
-                        input: Union[torch.Tensor, Tuple[torch.Tensor, ...]],
-                        output: torch.Tensor) -> None:
-        activation = output
+    @property
+    def activations(self) -> List[torch.Tensor]:
+        return [activation for activation in self._activations if activation is not None]
+
+    @property
+    def gradients(self) -> List[torch.Tensor]:
+        # Empty after a gradient-free pass
+        return [gradient for gradient in self._gradients if gradient is not None]
+
+    def store(self, buffers: List[Optional[torch.Tensor]], index: int, tensor: torch.Tensor) -> torch.Tensor:
+        """Copy tensor into the CPU buffer of layer `index`, reallocating it only when the shape changes"""
         if self.reshape_transform is not None:
-            activation = self.reshape_transform(activation)
-        self.activations.append(activation.cpu().detach())
+            tensor = self.reshape_transform(tensor)
+        tensor = tensor.detach()
+        buffer = buffers[index]
+        if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+            # A normal tensor, so passes in and out of inference_mode can both write it
+            with torch.inference_mode(False):
+                buffer = buffers[index] = torch.empty(tensor.shape, dtype=tensor.dtype)
+        return buffer.copy_(tensor)
 
-    def save_gradient(self, module: torch.nn.Module,
-                      input: Union[torch.Tensor, Tuple[torch.Tensor, ...]],
-                      output: torch.Tensor) -> None:
-        if not hasattr(output, "requires_grad") or not output.requires_grad:
+    def save_activation(self, index: int, module: torch.nn.Module,
+                        input: Union[torch.Tensor, Tuple[torch.Tensor, ...]],
+                        output: torch.Tensor) -> None:
+        if not self.recording:
             return
-        # Gradients are computed in reverse order
-        def _store_grad(grad: torch.Tensor) -> None:
-            if self.reshape_transform is not None:
-                grad = self.reshape_transform(grad)
-            self.gradients = [grad.cpu().detach()] + self.gradients
-        output.register_hook(_store_grad)
-
-    def post_process(self, result: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, np.ndarray]:
-        logits_ = result[:, 4:]
-        boxes_ = result[:, :4]
-        sorted, indices = torch.sort(logits_.max(1)[0], descending=True)
-        return torch.transpose(logits_[0], dim0=0, dim1=1)[indices[0]], torch.transpose(boxes_[0], dim0=0, dim1=1)[
-            indices[0]], xywh2xyxy(torch.transpose(boxes_[0], dim0=0, dim1=1)[indices[0]]).cpu().detach().numpy()
+        self._activations[index] = self.store(self.activation_buffers, index, output)
+        if getattr(output, "requires_grad", False):
+            # The tensor hook goes away with the graph after the backward pass
+            output.register_hook(functools.partial(self.save_gradient, index))
+
+    def save_gradient(self, index: int, grad: torch.Tensor) -> None:
+        self._gradients[index] = self.store(self.gradient_buffers, index, grad)
+
+    def post_process(self, result: torch.Tensor, index: int = 0) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Per-anchor class scores [N, nc] and xywh boxes [N, 4] of one image, as
+        views of the raw output. The CAM target sums over every anchor above
+        the confidence threshold, so the anchors do not need to be sorted.
+        """
+        return result[index, 4:].T, result[index, :4].T
 
     def __call__(self, x: torch.Tensor) -> List[List[Union[torch.Tensor, np.ndarray]]]:
-        self.gradients = []
-        self.activations = []
-        model_output = self.model(x)
-        post_result, pre_post_boxes, post_boxes = self.post_process(
-            model_output[0])
-        return [[post_result, pre_post_boxes]]
+        self.clear()
+        self.recording = True
+        try:
+            model_output = self.model(x)
+        finally:
+            self.recording = False
+        # Keep the raw predictions so NMS can reuse this pass
+        self.raw_output = model_output[0].detach()
+        # One [post_result, pre_post_boxes] entry per image in the batch
+        outputs = []
+        for index in range(x.size(0)):
+            post_result, pre_post_boxes = self.post_process(
+                model_output[0], index)
+            outputs.append([post_result, pre_post_boxes])
+        return outputs
+
+    def clear(self) -> None:
+        """Forget the last call; the buffers are kept for the next one"""
+        self._activations = [None] * len(self.handles)
+        self._gradients = [None] * len(self.handles)
+        self.raw_output = None
 
     def release(self) -> None:
         for handle in self.handles:
             handle.remove()
+        self.handles = []
+        self.activation_buffers = self.gradient_buffers = []
+        self.clear()
 
 # -------------------- YOLOv8 Target Class --------------------
 
@@ -144,16 +720,65 @@ class yolov8_target(torch.nn.Module):
         self.ratio = ratio
 
     def forward(self, data):
+        """Sum of the top class score (and the box) of every anchor whose top score reaches conf"""
         post_result, pre_post_boxes = data
-        result = []
-        for i in range(post_result.size(0)):
-            if float(post_result[i].max()) >= self.conf:
-                if self.ouput_type == 'class' or self.ouput_type == 'all':
-                    result.append(post_result[i].max())
-                if self.ouput_type == 'box' or self.ouput_type == 'all':
-                    for j in range(4):
-                        result.append(pre_post_boxes[i, j])
-        return sum(result)
+        scores = post_result.max(1)[0]
+        mask = scores >= self.conf
+        result = scores.new_zeros(())
+        if self.ouput_type == 'class' or self.ouput_type == 'all':
+            result = result + scores[mask].sum()
+        if self.ouput_type == 'box' or self.ouput_type == 'all':
+            result = result + pre_post_boxes[mask].sum()
+        return result
+
+# -------------------- Eigen CAM Projection --------------------
+
+# Function to project activations onto their first principal component
+def get_2d_projection(activation_batch):
+    """
+    Same projection as pytorch_grad_cam's get_2d_projection, but with a thin
+    SVD. The full SVD also builds an (H*W) x (H*W) U matrix (about 1 GB for
+    a stride-8 layer at 1024 px), and only the first row of VT is used.
+    """
+    activation_batch[np.isnan(activation_batch)] = 0
+    projections = []
+    for activations in activation_batch:
+        reshaped_activations = activations.reshape(activations.shape[0], -1).T
+        # Centering before the SVD keeps the projection from coming out negative
+        reshaped_activations = reshaped_activations - reshaped_activations.mean(axis=0)
+        _, _, VT = np.linalg.svd(reshaped_activations, full_matrices=False)
+        projection = reshaped_activations @ VT[0, :]
+        projections.append(projection.reshape(activations.shape[1:]))
+    return np.float32(projections)
+
+# CAM methods that only need the forward activations
+GRADIENT_FREE_CAM_METHODS = ("EigenCAM",)
+
+# Function to import pytorch_grad_cam and return its CAM classes by name
+@functools.lru_cache(maxsize=None)
+def cam_methods():
+    """Importing pytorch_grad_cam takes seconds, so it waits for the first heatmap"""
+    pytorch_grad_cam = lazy_import("pytorch_grad_cam", "heatmap")
+
+    class EigenCAM(pytorch_grad_cam.EigenCAM):
+        def get_cam_image(self, input_tensor, target_layer, target_category, activations, grads, eigen_smooth):
+            return get_2d_projection(activations)
+
+    class EigenGradCAM(pytorch_grad_cam.EigenGradCAM):
+        def get_cam_image(self, input_tensor, target_layer, target_category, activations, grads, eigen_smooth):
+            return get_2d_projection(grads * activations)
+
+    methods = {name: getattr(pytorch_grad_cam, name) for name in (
+        "GradCAM", "GradCAMPlusPlus", "HiResCAM", "LayerCAM", "RandomCAM", "XGradCAM")}
+    methods.update(EigenCAM=EigenCAM, EigenGradCAM=EigenGradCAM)
+    return methods
+
+# pytorch_grad_cam's image helpers, imported along with the CAM methods
+def scale_cam_image(*args, **kwargs):
+    return lazy_import("pytorch_grad_cam.utils.image", "heatmap").scale_cam_image(*args, **kwargs)
+
+def show_cam_on_image(*args, **kwargs):
+    return lazy_import("pytorch_grad_cam.utils.image", "heatmap").show_cam_on_image(*args, **kwargs)
 
 # -------------------- YOLOv8 Heatmap Class --------------------
 
@@ -165,40 +790,76 @@ class yolov8_heatmap:
             method="EigenGradCAM",
             layer=[12, 17, 21],
             conf_threshold=0.2,
+            iou_threshold=0.45,
             ratio=0.02,
             show_box=True,
             renormalize=False,
+            imgsz=None,
+            backend="torch",
+            precision="fp32",
+            mode="full",
     ) -> None:
         device = device
         backward_type = "all"
-        ckpt = torch.load(weight)
-        model_names = ckpt['model'].names
-        model = attempt_load_weights(weight, device)
-        model.info()
-        for p in model.parameters():
-            p.requires_grad_(True)
+        # Share the module loaded for detection instead of reading the checkpoint again
+        model = model_registry.get(weight).model.to(device)
+        model_names = model.names
         model.eval()
+        if imgsz is None:
+            imgsz = getattr(model, "args", {}).get("imgsz", 640)
         target = yolov8_target(backward_type, conf_threshold, ratio)
         target_layers = [model.model[l] for l in layer]
-        method = eval(method)(model, target_layers,
-                              use_cuda=device.type == 'cuda')
-        method.activations_and_grads = ActivationsAndGradients(
-            model, target_layers, None)
+        # Only the layers from the first CAM layer onward need gradients, so the
+        # backward pass stops there instead of running through the backbone.
+        # Step back to the nearest layer with parameters so that a
+        # parameter-free first layer (e.g. Upsample) still gets a gradient.
+        first_layer = min(l % len(model.model) for l in layer)
+        while first_layer > 0 and next(model.model[first_layer].parameters(), None) is None:
+            first_layer -= 1
+        grad_params = set(p for m in model.model[first_layer:] for p in m.parameters())
+        if mode == "off":
+            # Heatmaps are disabled, so no CAM method and no hooks either
+            method = None
+            extractor = None
+        else:
+            # The hooks go on now, the grad-cam method object is only built on
+            # the first CAM (see the method property)
+            extractor = ActivationsAndGradients(model, target_layers, None)
+        uses_gradients = method not in GRADIENT_FREE_CAM_METHODS
         colors = np.random.uniform(
             0, 255, size=(len(model_names), 3)).astype(int)
-        self.__dict__.update(locals())
+        # Detection runs on the exported graph or at reduced precision when
+        # selected; the CAM needs gradients so it stays on fp32 torch
+        detector = load_detector(weight, backend, precision, imgsz, device, model)
+        # Everything but self, which would make every wrapper a reference cycle
+        self.__dict__.update({name: value for name, value in locals().items() if name not in ("self", "method")})
+        self.method_name = method
+        self._method = None
+
+    @property
+    def method(self):
+        """The pytorch_grad_cam method, None with heatmaps off"""
+        if self._method is None and self.method_name is not None:
+            method = cam_methods()[self.method_name](self.model, self.target_layers,
+                                                     use_cuda=self.device.type == 'cuda')
+            # Remove the hooks of the default extractor before swapping in ours,
+            # otherwise they keep recording every forward of the shared module
+            method.activations_and_grads.release()
+            method.activations_and_grads = self.extractor
+            self._method = method
+        return self._method
 
     def post_process(self, result):
+        """Run NMS and return the filtered [N, 6] detections for each image in the batch"""
         processed_result = non_max_suppression(
             result,
             conf_thres=self.conf_threshold,
-            iou_thres=0.45
+            iou_thres=self.iou_threshold
         )
-        if len(processed_result) == 0 or processed_result[0].numel() == 0:
-            return torch.empty(0, 6)
-        detections = processed_result[0]
-        mask = detections[:, 4] >= self.conf_threshold
-        filtered_detections = detections[mask]
+        filtered_detections = []
+        for detections in processed_result:
+            mask = detections[:, 4] >= self.conf_threshold
+            filtered_detections.append(detections[mask])
         return filtered_detections
 
     def draw_detections(self, box, color, name, img):
@@ -235,29 +896,35 @@ class yolov8_heatmap:
             image_float_np, renormalized_cam, use_rgb=True)
         return eigencam_image_renormalized
 
-    def process(self, img_path):
-        img = cv2.imread(img_path)
-        img = letterbox(img)[0]
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = np.float32(img) / 255.0
-        tensor = (
-            torch.from_numpy(np.transpose(img, axes=[2, 0, 1]))
-            .unsqueeze(0)
-            .to(self.device)
-        )
-        try:
-            grayscale_cam = self.method(tensor, [self.target])
-        except AttributeError as e:
-            print(f"Error generating CAM: {e}")
-            return None
-        grayscale_cam = grayscale_cam[0, :]
-        pred1 = self.model(tensor)[0]
-        pred = non_max_suppression(
-            pred1,
-            conf_thres=self.conf_threshold,
-            iou_thres=0.45
-        )[0]
-        
+    def enable_gradients(self):
+        # The detector may disable gradients on the shared module, so set them
+        # right before every CAM pass
+        for p in self.model.parameters():
+            p.requires_grad_(p in self.grad_params)
+
+    def cam_forward(self, tensor):
+        """Forward pass recording the CAM layers; gradient-free methods run it under inference_mode"""
+        extractor = self.extractor
+        if self.uses_gradients:
+            self.enable_gradients()
+            return extractor(tensor)
+        with torch.inference_mode():
+            outputs = extractor(tensor)
+        # NMS edits the predictions in place, which inference tensors only allow in inference_mode
+        extractor.raw_output = extractor.raw_output.clone()
+        return outputs
+
+    def compute_cam(self, tensor, outputs):
+        """Backward pass and CAM aggregation on top of an existing forward pass"""
+        if self.uses_gradients:
+            self.model.zero_grad()
+            loss = sum(self.target(output) for output in outputs)
+            loss.backward()
+        targets = [self.target] * tensor.size(0)
+        cam_per_layer = self.method.compute_cam_per_layer(tensor, targets, False)
+        return self.method.aggregate_multi_layers(cam_per_layer)
+
+    def render_cam(self, img, grayscale_cam, pred):
         if self.renormalize:
             cam_image = self.renormalize_cam(
                 pred[:, :4].cpu().detach().numpy().astype(np.int32),
@@ -277,76 +944,503 @@ class yolov8_heatmap:
                     f"{self.model_names[class_index]}",
                     cam_image,
                 )
-        cam_image = Image.fromarray(cam_image)
         return cam_image
 
+    def process_batch(self, images, with_cam=True, keep_cam=None):
+        """
+        Run one shared forward pass over a batch of ImageContexts (or RGB images,
+        or image paths) and return a (detections, cam_image) tuple per image.
+        Detections are the NMS boxes as [x1, y1, x2, y2, conf, cls] in the
+        coordinates of the context's rgb image; cam_image is the RGB heatmap
+        overlay, None when nothing was detected in that image, with_cam is
+        False, keep_cam(detections) is False or the CAM failed. The CAM pass
+        is skipped when no image of the batch keeps it.
+        """
+        try:
+            return self.run_batch(images, with_cam, keep_cam)
+        finally:
+            # Nothing recorded for this batch outlives it
+            self.clear()
+
+    def run_batch(self, images, with_cam, keep_cam=None):
+        contexts = [image_context(image) for image in images]
+        tensors = [context.tensor(self.imgsz) for context in contexts]
+        # A single image is used as is, a batch costs one stacking copy
+        tensor = tensors[0][None] if len(tensors) == 1 else torch.stack(tensors)
+        tensor = tensor.to(self.device)
+        with_cam = with_cam and self.extractor is not None
+        outputs = None
+        with timed("forward"):
+            if self.detector is not None:
+                raw_output = self.detector(tensor)
+            elif with_cam:
+                # The hooks record the CAM activations and the raw predictions are
+                # reused for NMS, so the model only runs forward once
+                outputs = self.cam_forward(tensor)
+                raw_output = self.extractor.raw_output
+            else:
+                with torch.inference_mode():
+                    raw_output = self.model(tensor)[0]
+                raw_output = raw_output.clone()
+        with timed("nms"):
+            preds = self.post_process(raw_output)
+            detections = []
+            for pred, context in zip(preds, contexts):
+                detection = pred.clone()
+                detection[:, :4] = scale_boxes(tensor.shape[2:], detection[:, :4], context.rgb.shape)
+                detections.append(detection)
+        wanted = [
+            with_cam and len(pred) > 0 and (keep_cam is None or keep_cam(detection))
+            for pred, detection in zip(preds, detections)
+        ]
+        if not any(wanted):
+            return [(detection, None) for detection in detections]
+
+        try:
+            if outputs is None:
+                # The detector has no gradients, so the CAM gets its own fp32
+                # torch forward pass, and only when something was found
+                with timed("cam_forward"):
+                    outputs = self.cam_forward(tensor)
+            with timed("cam"):
+                grayscale_cams = self.compute_cam(tensor, outputs)
+        except Exception as e:
+            print(f"Warning: Heatmap generation error: {str(e)}")
+            return [(detection, None) for detection in detections]
+
+        results = []
+        with timed("cam_overlay"):
+            for image, grayscale_cam, pred, detection, want in zip(tensors, grayscale_cams, preds, detections, wanted):
+                # HWC view of the input tensor, no copy
+                img = image.permute(1, 2, 0).numpy()
+                cam_image = self.render_cam(img, grayscale_cam, pred) if want else None
+                results.append((detection, cam_image))
+        return results
+
+    def process(self, image, with_cam=True):
+        """Single-image version of process_batch"""
+        return self.process_batch([image], with_cam)[0]
+
+    def clear(self):
+        """Drop the activations, gradients and parameter gradients of the last CAM pass"""
+        if self.extractor is not None:
+            self.extractor.clear()
+            self.model.zero_grad(set_to_none=True)
+
+    def release(self):
+        """Remove the CAM hooks from the shared module"""
+        if self.extractor is not None:
+            self.extractor.release()
+
     def save_result(self, img_path, output_path):
         """Process an image and save the result to a file"""
-        result = self.process(img_path)
+        _, result = self.process(img_path)
         if result is not None:
-            result.save(output_path)
+            write_image(output_path, cv2.cvtColor(result, cv2.COLOR_RGB2BGR, dst=result), "heatmap")
             return True
         return False
 
+# Heatmap wrappers are cached per checkpoint version so their hooks are only
+# registered once. Inference is serialized through _model_lock because the
+# CAM hooks keep per-call state.
+_heatmap_models = {}
+_heatmap_lock = threading.Lock()
+_model_lock = threading.Lock()
+
+# Heatmap settings used for every request; also part of the result cache key
+HEATMAP_SETTINGS = {
+    "mode": "full",
+    "conf_threshold": 0.2,
+    "method": "EigenGradCAM",
+    "layer": [10, 12, 14, 16, 18, -3],
+    # Same IoU as the ultralytics predictor the detections used to come from
+    "iou_threshold": 0.7,
+    "ratio": 0.02,
+    "show_box": True,
+    "renormalize": False,
+}
+
+# CAM method and layers of each heatmap mode (see configure_heatmap)
+HEATMAP_MODES = {
+    "full": {"method": "EigenGradCAM", "layer": [10, 12, 14, 16, 18, -3]},
+    # Forward activations only (no backward pass, no gradients) of the two
+    # stride-16 C2f outputs
+    "fast": {"method": "EigenCAM", "layer": [12, 18]},
+    # Detection only
+    "off": {},
+}
+
+def configure_heatmap(mode="full", layers=None):
+    HEATMAP_SETTINGS["mode"] = mode
+    HEATMAP_SETTINGS.update(HEATMAP_MODES[mode])
+    if layers:
+        HEATMAP_SETTINGS["layer"] = list(layers)
+
+# Runtime and precision of the detection forward pass (see configure_detector);
+# also part of the result cache key
+DETECTOR_SETTINGS = {
+    "backend": "torch",
+    "precision": "fp32",
+}
+
+def configure_detector(backend="torch", precision="fp32"):
+    DETECTOR_SETTINGS["backend"] = backend
+    DETECTOR_SETTINGS["precision"] = precision
+
+def result_settings():
+    """Everything besides the image and the checkpoint that changes the results"""
+    encoding = {artifact: ENCODING_SETTINGS[artifact] for artifact in ("overlay", "heatmap")}
+    settings = {**HEATMAP_SETTINGS, **DETECTOR_SETTINGS, **DECODE_SETTINGS, "encoding": encoding}
+    # The cached result holds the explanation text, so a stub run must not serve an OpenAI one
+    settings["explanation"] = get_explanation_service().backend.settings()
+    if TRIAGE_SETTINGS["model"]:
+        settings["triage"] = dict(TRIAGE_SETTINGS)
+    if CASCADE_SETTINGS["model"]:
+        settings["cascade"] = dict(CASCADE_SETTINGS)
+    return settings
+
+def get_heatmap_model(model_path, backend=None, precision=None):
+    backend = backend or DETECTOR_SETTINGS["backend"]
+    precision = precision or DETECTOR_SETTINGS["precision"]
+    # A change of heatmap mode or layers (see configure_heatmap) builds a new wrapper
+    key = model_registry.key(model_path) + (backend, precision, json.dumps(HEATMAP_SETTINGS, sort_keys=True))
+    with _heatmap_lock:
+        if key not in _heatmap_models:
+            for stale in [k for k in _heatmap_models if k[0] == key[0] and k[2:] == key[2:]]:
+                _heatmap_models.pop(stale).release()
+            check_precision_validated(model_path, backend, precision)
+            _heatmap_models[key] = yolov8_heatmap(
+                weight=model_path, backend=backend, precision=precision, **HEATMAP_SETTINGS)
+        return _heatmap_models[key]
+
+# -------------------- Triage --------------------
+
+# Image-level normal/abnormal classifier that runs before the detector (trained
+# with python-code/classification/train_triage.py). Studies it calls normal with
+# at least `threshold` probability skip detection, CAM and explanation.
+# Disabled while model is None; also part of the result cache key when enabled.
+TRIAGE_SETTINGS = {
+    "model": None,
+    "threshold": 0.9,
+    "imgsz": 224,
+    "normal_class": "normal",
+}
+
+def configure_triage(model=None, threshold=0.9, imgsz=224, normal_class="normal"):
+    TRIAGE_SETTINGS["model"] = model
+    TRIAGE_SETTINGS["threshold"] = threshold
+    TRIAGE_SETTINGS["imgsz"] = imgsz
+    TRIAGE_SETTINGS["normal_class"] = normal_class
+
+class TriageStats:
+    """Counts the studies the triage classifier has seen and let skip the detector"""
+    def __init__(self) -> None:
+        self.seen = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def add(self, seen: int, skipped: int) -> None:
+        with self._lock:
+            self.seen += seen
+            self.skipped += skipped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "seen": self.seen,
+                "skipped": self.skipped,
+                "skip_rate": self.skipped / self.seen if self.seen else 0.0,
+            }
+
+triage_stats = TriageStats()
+
+# Function to run the triage classifier on a batch of ImageContexts
+def triage_batch(contexts):
+    """
+    Returns one flag per context, True for the studies that are confidently
+    normal. Each context gets its verdict in context.triage.
+    """
+    if not TRIAGE_SETTINGS["model"]:
+        return [False] * len(contexts)
+    classifier = model_registry.get(TRIAGE_SETTINGS["model"])
+    class_indices = {name: index for index, name in classifier.names.items()}
+    if TRIAGE_SETTINGS["normal_class"] not in class_indices:
+        raise ValueError(
+            f"Triage model has no class {TRIAGE_SETTINGS['normal_class']!r} (classes: {list(class_indices)})")
+    imgsz = TRIAGE_SETTINGS["imgsz"]
+    with timed("triage"):
+        # The classifier is trained, and its threshold swept, on the padded
+        # squares of preprocess_dataset.py shrunk to imgsz, so build the same
+        # input from the original rather than the stretched rgb resize (BGR,
+        # as the predictor takes it)
+        images = [
+            cv2.resize(
+                letterbox(context.original, max(context.target_size), color=(0, 0, 0), auto=False)[0],
+                (imgsz, imgsz), interpolation=cv2.INTER_AREA)
+            for context in contexts
+        ]
+        predictions = classifier.predict(images, imgsz=imgsz, verbose=False)
+    normal = []
+    for context, prediction in zip(contexts, predictions):
+        probability = float(prediction.probs.data[class_indices[TRIAGE_SETTINGS["normal_class"]]])
+        normal.append(probability >= TRIAGE_SETTINGS["threshold"])
+        context.triage = {"normal_probability": round(probability, 4), "skipped_detection": normal[-1]}
+    triage_stats.add(len(contexts), sum(normal))
+    return normal
+
+# -------------------- Detector Cascade --------------------
+
+# Two detector tiers (see configure_cascade): --model (YOLOv8n) runs on every
+# study and only the ambiguous ones go to the cascade model (YOLOv8s), i.e.
+# studies with a detection whose confidence falls in [band low, band high) or
+# with two detections of different classes on the same spot (IoU at least
+# disagreement_iou). Disabled while model is None; also part of the result
+# cache key when enabled.
+CASCADE_SETTINGS = {
+    "model": None,
+    "band": [0.2, 0.5],
+    "disagreement_iou": 0.5,
+    "merge_iou": 0.5,
+}
+
+def configure_cascade(model=None, band=(0.2, 0.5), disagreement_iou=0.5, merge_iou=0.5):
+    CASCADE_SETTINGS["model"] = model
+    CASCADE_SETTINGS["band"] = list(band)
+    CASCADE_SETTINGS["disagreement_iou"] = disagreement_iou
+    CASCADE_SETTINGS["merge_iou"] = merge_iou
+
+class CascadeStats:
+    """Escalation counters, what the merges dropped and per-tier latency of the cascade"""
+    def __init__(self) -> None:
+        self.seen = 0
+        self.reasons = {}
+        self.dropped_detections = 0
+        self.cleared = 0
+        self.tier_images = [0, 0]
+        self.tier_seconds = [0.0, 0.0]
+        self._lock = threading.Lock()
+
+    def add_tier(self, tier: int, images: int, seconds: float) -> None:
+        with self._lock:
+            self.tier_images[tier] += images
+            self.tier_seconds[tier] += seconds
+
+    def add_escalations(self, reasons: List[Optional[str]]) -> None:
+        with self._lock:
+            self.seen += len(reasons)
+            for reason in filter(None, reasons):
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def add_merge(self, dropped: int, cleared: bool) -> None:
+        with self._lock:
+            self.dropped_detections += dropped
+            self.cleared += int(cleared)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            escalated = sum(self.reasons.values())
+            return {
+                "seen": self.seen,
+                "escalated": escalated,
+                "escalation_rate": escalated / self.seen if self.seen else 0.0,
+                "reasons": dict(self.reasons),
+                # First-tier detections the second tier did not confirm, and the
+                # escalated studies that went from findings to none because of it
+                "dropped_detections": self.dropped_detections,
+                "cleared": self.cleared,
+                "cleared_rate": self.cleared / self.seen if self.seen else 0.0,
+                "tiers": [
+                    {
+                        "images": images,
+                        "mean_ms": round(seconds * 1000 / images, 2) if images else 0.0,
+                    }
+                    for images, seconds in zip(self.tier_images, self.tier_seconds)
+                ],
+            }
+
+cascade_stats = CascadeStats()
+
+# Function to decide whether the first tier's detections need the second tier
+def escalation_reason(detections, band=None):
+    """Returns "confidence", "class_disagreement" or None"""
+    low, high = band or CASCADE_SETTINGS["band"]
+    confidences = detections[:, 4]
+    if ((confidences >= low) & (confidences < high)).any():
+        return "confidence"
+    if len(detections) > 1:
+        iou = box_iou(detections[:, :4], detections[:, :4])
+        different = detections[:, 5][:, None] != detections[:, 5][None, :]
+        if ((iou >= CASCADE_SETTINGS["disagreement_iou"]) & different).any():
+            return "class_disagreement"
+    return None
+
+# Function to merge the detections of both tiers for an escalated study
+def merge_detections(first, second, band=None):
+    """
+    The second tier's detections plus the ones the first tier was sure of (at
+    or above the band), deduplicated per class at merge_iou keeping the more
+    confident box, by descending confidence. Returns (merged, from_first,
+    dropped): from_first counts the first tier's boxes in merged, dropped the
+    first-tier detections no merged box of the same class overlaps at merge_iou.
+    """
+    high = (band or CASCADE_SETTINGS["band"])[1]
+    merged = torch.cat([second, first[first[:, 4] >= high].to(second.dtype)])
+    keep = torchvision.ops.batched_nms(merged[:, :4], merged[:, 4], merged[:, 5], CASCADE_SETTINGS["merge_iou"])
+    from_first = int((keep >= len(second)).sum())
+    merged = merged[keep]
+    matched = box_iou(first[:, :4], merged[:, :4].to(first.dtype)) >= CASCADE_SETTINGS["merge_iou"]
+    matched &= first[:, 5][:, None] == merged[:, 5][None, :].to(first.dtype)
+    dropped = int((~matched.any(1)).sum())
+    return merged, from_first, dropped
+
+# Function to run the detector, or the cascade when one is configured, on a batch of ImageContexts
+def detect_batch(heatmap_model, contexts, with_cam):
+    """
+    Returns the same (detections, cam_image) tuples as process_batch. With
+    the cascade, the first tier's forward pass also records the CAM layers,
+    and the CAM is only computed for studies it keeps; escalated studies get
+    the second tier's CAM, which shows the second tier's boxes only. Each
+    context gets its verdict in context.cascade, including how many of the
+    reported boxes the heatmap leaves out and how many first-tier detections
+    the escalation dropped.
+    """
+    if not CASCADE_SETTINGS["model"]:
+        return heatmap_model.process_batch(contexts, with_cam)
+    escalation_model = get_heatmap_model(CASCADE_SETTINGS["model"])
+    if escalation_model.model_names != heatmap_model.model_names:
+        raise ValueError("The cascade models must be trained on the same classes")
+
+    started = time.perf_counter()
+    # One first-tier pass; only the studies it keeps pay for the CAM
+    outputs = heatmap_model.process_batch(
+        contexts, with_cam, keep_cam=lambda detections: escalation_reason(detections) is None)
+    cascade_stats.add_tier(0, len(contexts), time.perf_counter() - started)
+    reasons = [escalation_reason(detections) for detections, _ in outputs]
+    cascade_stats.add_escalations(reasons)
+    for context, reason in zip(contexts, reasons):
+        context.cascade = {"escalated": reason is not None, "reason": reason, "heatmap_tier": 2 if reason else 1}
+
+    escalated = [i for i, reason in enumerate(reasons) if reason]
+    if escalated:
+        started = time.perf_counter()
+        second = escalation_model.process_batch([contexts[i] for i in escalated], with_cam)
+        cascade_stats.add_tier(1, len(escalated), time.perf_counter() - started)
+        for i, (detections, cam_image) in zip(escalated, second):
+            first = outputs[i][0]
+            merged, from_first, dropped = merge_detections(first, detections)
+            cascade_stats.add_merge(dropped, len(first) > 0 and len(merged) == 0)
+            # First-tier boxes are on the overlay and in the findings, not on the second tier's heatmap
+            contexts[i].cascade.update(boxes_missing_from_heatmap=from_first, dropped_detections=dropped)
+            outputs[i] = (merged, cam_image)
+    return outputs
+
 # Function to preprocess image for inference
 def preprocess_image(image_path, target_size=(1024, 1024)):
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"Error: Could not load image from {image_path}")
+    """Returns (rgb, resized_bgr, original); prefer an ImageContext, which keeps them for later stages"""
+    context = ImageContext(image_path, target_size)
+    if context.rgb is None:
         return None, None, None
+    return context.rgb, cv2.cvtColor(context.rgb, cv2.COLOR_RGB2BGR), context.original
 
-    # Resize to target size
-    image_resized = cv2.resize(image, target_size, interpolation=cv2.INTER_LINEAR)
-    
-    # Convert to RGB (YOLO expects RGB images)
-    image_rgb = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
+# Function to write the annotated detection image and heatmap for one image
+def save_detections(image_rgb, detections, cam_image, image_path, output_path, heatmap_output, names):
+    # Get detected conditions and their bounding boxes
+    detected_conditions = []
+    detected_boxes = []
     
-    return image_rgb, image_resized, image
-
-# Function to run YOLO inference
-def run_yolo_inference(image_path, output_path, model_path):
-    try:
-        # Load the model
-        model = YOLO(model_path)
-        
-        # Preprocess the image
-        preprocessed_image, _, _ = preprocess_image(image_path)
-        if preprocessed_image is None:
-            return False, [], []
-        
-        # Run YOLOv8 inference
-        results = model(preprocessed_image, conf=0.2)
-        
-        # Get detected conditions and their bounding boxes
-        detected_conditions = []
-        detected_boxes = []
-        
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                # Get class name
-                cls_id = int(box.cls[0])
-                cls_name = model.names[cls_id]
-                conf = float(box.conf[0])
-                detected_conditions.append(f"{cls_name} (confidence: {conf:.2f})")
-                
-                # Get coordinates (x1, y1, x2, y2 format)
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                detected_boxes.append([x1, y1, x2, y2])
+    for detection in detections.tolist():
+        # Get class name
+        cls_name = names[int(detection[5])]
+        conf = detection[4]
+        detected_conditions.append(f"{cls_name} (confidence: {conf:.2f})")
         
+        # Get coordinates (x1, y1, x2, y2 format)
+        detected_boxes.append(detection[:4])
+    
+    with timed("draw"):
         # Get the result image with annotations (even if no detections)
-        result_image = results[0].plot()
+        result_image = Results(image_rgb, path=image_path, names=names, boxes=detections.cpu()).plot()
         
-        # Convert from RGB to BGR for OpenCV
-        result_image_bgr = cv2.cvtColor(result_image, cv2.COLOR_RGB2BGR)
-        
-        # Save the result image
-        cv2.imwrite(output_path, result_image_bgr)
-        
-        return True, detected_conditions, detected_boxes
+        # Convert from RGB to BGR for OpenCV (in place, plot returns a new array)
+        result_image_bgr = cv2.cvtColor(result_image, cv2.COLOR_RGB2BGR, dst=result_image)
+    
+    # Save the result image and the heatmap, encoded side by side
+    timer = _current_timer.get()
+    writes = [encode_pool.submit(write_image, output_path, result_image_bgr, "overlay", timer)]
+    if cam_image is not None and heatmap_output:
+        # The overlay array is not used after this, so convert it in place too
+        cam_image_bgr = cv2.cvtColor(cam_image, cv2.COLOR_RGB2BGR, dst=cam_image)
+        writes.append(encode_pool.submit(write_image, heatmap_output, cam_image_bgr, "heatmap", timer))
+    for write in writes:
+        write.result()
+    
+    return True, detected_conditions, detected_boxes
+
+# Function to run YOLO inference on a batch of images
+def run_yolo_inference_batch(images, output_paths, model_path, heatmap_outputs=None, batch_size=4):
+    """
+    Batched version of run_yolo_inference. images are ImageContexts or image
+    paths; they are letterboxed into one stacked tensor per batch of
+    batch_size. Returns one (success, conditions, boxes) tuple per image.
+    """
+    contexts = [image_context(image) for image in images]
+    if heatmap_outputs is None:
+        heatmap_outputs = [None] * len(contexts)
+    results = [(False, [], [])] * len(contexts)
+    try:
+        # The heatmap wrapper owns the shared detector module
+        heatmap_model = get_heatmap_model(model_path)
     except Exception as e:
         print(f"Error in YOLO inference: {str(e)}")
-        return False, [], []
+        return results
+    
+    for start in range(0, len(contexts), max(1, batch_size)):
+        # Decode the images, skipping the ones that fail to load
+        batch = [
+            i for i in range(start, min(start + batch_size, len(contexts)))
+            if contexts[i].rgb is not None
+        ]
+        if not batch:
+            continue
+        
+        try:
+            normal = triage_batch([contexts[i] for i in batch])
+        except Exception as e:
+            # Without a verdict every study goes through the detector
+            print(f"Warning: Triage failed, running detection on every image: {str(e)}")
+            normal = [False] * len(batch)
+        
+        try:
+            # Confidently normal studies only get the plain image, like a study without detections
+            for i in [i for i, skip in zip(batch, normal) if skip]:
+                results[i] = save_detections(
+                    contexts[i].rgb, torch.zeros((0, 6)), None, contexts[i].path,
+                    output_paths[i], heatmap_outputs[i], heatmap_model.model_names)
+            batch = [i for i, skip in zip(batch, normal) if not skip]
+            if not batch:
+                continue
+            
+            # Run the detection forward pass (and the CAM on top of it if needed)
+            outputs = detect_batch(
+                heatmap_model,
+                [contexts[i] for i in batch],
+                with_cam=any(heatmap_outputs[i] is not None for i in batch))
+            for i, (detections, cam_image) in zip(batch, outputs):
+                results[i] = save_detections(
+                    contexts[i].rgb, detections, cam_image, contexts[i].path,
+                    output_paths[i], heatmap_outputs[i], heatmap_model.model_names)
+        except Exception as e:
+            print(f"Error in YOLO inference: {str(e)}")
+    return results
+
+# Function to run YOLO inference
+def run_yolo_inference(image, output_path, model_path, heatmap_output=None):
+    """
+    Detect conditions in an ImageContext (or image path) and save the
+    annotated image. When heatmap_output is set the heatmap is generated from
+    the same forward pass and saved there.
+    """
+    return run_yolo_inference_batch([image], [output_path], model_path, [heatmap_output])[0]
 
 # Function to crop an image to show only the detected region
 def crop_detection(image, box, padding=20):
@@ -362,192 +1456,605 @@ def crop_detection(image, box, padding=20):
     # Crop the image
     return image[int(y1):int(y2), int(x1):int(x2)]
 
-# Function to encode image to base64 string
-def encode_image_to_base64(image_array):
-    # Convert numpy array to PIL Image
-    img = Image.fromarray(image_array)
-    
-    # Save image to BytesIO object
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    
-    # Encode BytesIO to base64
-    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-    return img_str
+# -------------------- Output Encoding --------------------
 
-# Function to get LLM explanation
-def get_technical_explanation(conditions, detected_boxes, original_image):
-    # Skip if no OpenAI API
-    # if not HAS_OPENAI:
-    #     return "AI-assisted explanations not available. Please check OPENAI_API_KEY in environment variables."
-    
+# (imencode extension, quality flag, mime type) per output format
+IMAGE_FORMATS = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION, "image/png"),
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp"),
+}
+FORMAT_EXTENSIONS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp"}
+
+# Encoding of each output artifact: the annotated detection image, the heatmap
+# and the images sent to the LLM (see configure_encoding). format None follows
+# the output file's extension; quality is the PNG compression level (0-9) or
+# the JPEG / WebP quality (0-100), None for the codec default; larger images
+# are downscaled to max_side first. The overlay settings are part of the
+# result cache key.
+ENCODING_SETTINGS = {
+    "overlay": {"format": None, "quality": 1, "max_side": None},
+    "heatmap": {"format": None, "quality": 1, "max_side": None},
+    # The vision model works on at most 2048 px anyway
+    "llm": {"format": "jpeg", "quality": 90, "max_side": 2048},
+}
+
+# Encoding releases the GIL, so crops and overlays are encoded on a shared pool
+encode_pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="encode")
+
+def configure_encoding(artifact, format=None, quality=None, max_side=None):
+    ENCODING_SETTINGS[artifact] = {"format": format, "quality": quality, "max_side": max_side}
+
+# Function to parse a "format[:quality]" encoding option (format "auto" follows the file extension)
+def parse_encoding(spec):
+    image_format, _, quality = spec.partition(":")
+    image_format = image_format.lower()
+    if image_format not in IMAGE_FORMATS and image_format != "auto":
+        raise argparse.ArgumentTypeError(f"unknown image format {image_format!r}")
     try:
-        # Prepare the detected regions without detailed coordinates
-        detection_details = []
-        region_images = []
-        
-        # Process each detection
-        for i, (condition, box) in enumerate(zip(conditions, detected_boxes)):
-            # Format condition details
-            condition_name = condition.split(" (confidence:")[0]
-            confidence = float(condition.split(": ")[1].rstrip(")"))
-            
-            # Just store condition and confidence - no coordinates
-            detection_details.append({
-                "condition": condition_name,
-                "confidence": confidence
-            })
-            
-            # Crop the region and encode as base64
-            cropped_region = crop_detection(original_image, box)
-            if cropped_region.size > 0:  # Ensure the crop is not empty
-                region_base64 = encode_image_to_base64(cropped_region)
-                region_images.append({
-                    "condition": condition_name,
-                    "base64_image": region_base64
-                })
-        
-        # Encode the full image with annotations
-        full_image_base64 = encode_image_to_base64(original_image)
-        
-        # Create the prompt
-        prompt = f"""
-        As a radiologist, provide a detailed technical explanation for a chest X-ray showing the following conditions: {[d['condition'] for d in detection_details]}.
-        
-        For each detected condition:
-        1. Describe the precise anatomical location using proper anatomical landmarks (e.g., "upper left lung field near the 3rd anterior rib," "right costophrenic angle," "left hilar region")
-        2. Explain the radiographic findings visible at this location
-        3. Provide technical insights on why this pathology typically appears at this anatomical location
-        4. Detail the underlying anatomical or physiological factors contributing to this presentation
-        5. Discuss the severity based on the visual characteristics and anatomical involvement
-        6. Explain technical considerations for differential diagnoses given the specific location
-        7. Include specific follow-up imaging recommendations with rationale
-        
-        Format as a professional medical report with technical details appropriate for a specialist.
-        """
+        quality = int(quality) if quality else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"quality must be an integer, got {quality!r}")
+    return None if image_format == "auto" else image_format, quality
+
+# Function to encode an image with the settings of one artifact
+def encode_image(image, artifact, extension=".png", timer=None):
+    """Encode a BGR (or grayscale) image; returns (encoded bytes as a uint8 array, mime type)"""
+    settings = ENCODING_SETTINGS[artifact]
+    image_format = settings["format"] or FORMAT_EXTENSIONS.get(extension.lower(), "png")
+    imencode_extension, quality_flag, mime_type = IMAGE_FORMATS[image_format]
+    with timed("encode", timer):
+        max_side = settings["max_side"]
+        if max_side and max(image.shape[:2]) > max_side:
+            scale = max_side / max(image.shape[:2])
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        params = [quality_flag, settings["quality"]] if settings["quality"] is not None else []
+        ok, encoded = cv2.imencode(imencode_extension, image, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {image_format}")
+    return encoded, mime_type
+
+# Function to write an image file with the settings of one artifact
+def write_image(path, image, artifact, timer=None):
+    encoded, _ = encode_image(image, artifact, os.path.splitext(path)[1], timer)
+    # Written straight from the encoder's buffer
+    encoded.tofile(path)
+
+# Function to encode image to a base64 data URL for the LLM
+def encode_image_to_data_url(image_array, timer=None):
+    encoded, mime_type = encode_image(image_array, "llm", timer=timer)
+    with timed("base64", timer):
+        img_str = base64.b64encode(encoded).decode('ascii')
+    return f"data:{mime_type};base64,{img_str}"
+
+# Function to split "Name (confidence: 0.53)" into its name and confidence
+def parse_condition(condition):
+    condition_name = condition.split(" (confidence:")[0]
+    confidence = float(condition.split(": ")[1].rstrip(")"))
+    return condition_name, confidence
+
+# Function to compute a perceptual (difference) hash of an image region
+def perceptual_hash(image, hash_size=8):
+    if image.size == 0:
+        return ""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1]).tobytes().hex()
+
+# Function to build the LLM requests for an explanation
+def build_explanation_messages(conditions, detected_boxes, original_image):
+    """
+    Returns (vision_messages, text_messages). vision_messages is None when there
+    are no region crops to send; text_messages is the text-only fallback.
+    """
+    # Prepare the detected regions without detailed coordinates
+    detection_details = []
+    region_crops = []
+    
+    # Process each detection
+    for i, (condition, box) in enumerate(zip(conditions, detected_boxes)):
+        # Format condition details
+        condition_name, confidence = parse_condition(condition)
         
-        # Check if we should use vision capabilities
-        use_vision = region_images and len(region_images) > 0
-        vision_model = "gpt-4o"  # Use the latest model with vision capabilities
+        # Just store condition and confidence - no coordinates
+        detection_details.append({
+            "condition": condition_name,
+            "confidence": confidence
+        })
         
+        # Crop the region (a view, nothing is copied until it is encoded)
+        cropped_region = crop_detection(original_image, box)
+        if cropped_region.size > 0:  # Ensure the crop is not empty
+            region_crops.append((condition_name, cropped_region))
+    
+    # Create the prompt
+    prompt = f"""
+    As a radiologist, provide a detailed technical explanation for a chest X-ray showing the following conditions: {[d['condition'] for d in detection_details]}.
+    
+    For each detected condition:
+    1. Describe the precise anatomical location using proper anatomical landmarks (e.g., "upper left lung field near the 3rd anterior rib," "right costophrenic angle," "left hilar region")
+    2. Explain the radiographic findings visible at this location
+    3. Provide technical insights on why this pathology typically appears at this anatomical location
+    4. Detail the underlying anatomical or physiological factors contributing to this presentation
+    5. Discuss the severity based on the visual characteristics and anatomical involvement
+    6. Explain technical considerations for differential diagnoses given the specific location
+    7. Include specific follow-up imaging recommendations with rationale
+    
+    Format as a professional medical report with technical details appropriate for a specialist.
+    """
+    
+    # Fallback to text-only if vision not supported or failed
+    text_messages = [
+        {"role": "system", "content": "You are a radiologist AI assistant with expertise in analyzing chest X-rays."},
+        {"role": "user", "content": prompt}
+    ]
+    
+    # Only use vision capabilities if we have regions
+    if not region_crops:
+        return None, text_messages
+    
+    # Encode the full image and the crops in parallel
+    timer = _current_timer.get()
+    images = [original_image] + [crop for _, crop in region_crops]
+    full_image_url, *region_urls = encode_pool.map(lambda image: encode_image_to_data_url(image, timer), images)
+    region_images = [
+        {"condition": condition_name, "image_url": url}
+        for (condition_name, _), url in zip(region_crops, region_urls)
+    ]
+    
+    messages = [
+        {"role": "system", "content": "You are a radiologist AI assistant with expertise in analyzing chest X-rays. Provide technical analysis of the detected regions."}
+    ]
+    
+    # Add the full annotated image first
+    content_parts = [
+        {"type": "text", "text": "Chest X-ray with detected conditions. I need detailed anatomical descriptions and explanations for each finding."},
+        {"type": "image_url", "image_url": {"url": full_image_url}}
+    ]
+    
+    # Add the prompt with detailed instructions
+    content_parts.append({"type": "text", "text": prompt})
+    
+    # Add the cropped regions for detailed analysis
+    for region in region_images:
+        content_parts.append({
+            "type": "text", 
+            "text": f"Close-up of detected {region['condition']}. Please describe the specific anatomical location and findings:"
+        })
+        content_parts.append({
+            "type": "image_url", 
+            "image_url": {"url": region['image_url']}
+        })
+    
+    messages.append({"role": "user", "content": content_parts})
+    return messages, text_messages
+
+# -------------------- Explanation Backends --------------------
+
+class OpenAIExplanationBackend:
+    """Chat completions through the asyncio OpenAI client"""
+    def __init__(self, model: str = "gpt-4o", timeout: float = 60.0) -> None:
+        self.model = model  # Use the latest model with vision capabilities
+        self.timeout = timeout
+        # Created with the first explanation, so X-rays without findings never import openai
+        self.client = None
+
+    async def complete(self, messages: List[Dict[str, Any]], max_tokens: int = 1500) -> str:
+        if self.client is None:
+            openai = lazy_import("openai", "explanation")
+            self.client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY", ""), timeout=self.timeout)
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content.strip()
+
+    def settings(self) -> Dict[str, Any]:
+        """What decides the explanation text; part of the result cache key"""
+        return {"backend": "openai", "model": self.model}
+
+class StubExplanationBackend:
+    """Offline backend for benchmarks and tests: answers after a fixed delay without any network access"""
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+
+    async def complete(self, messages: List[Dict[str, Any]], max_tokens: int = 1500) -> str:
+        await asyncio.sleep(self.latency)
+        content = messages[-1]["content"]
+        images = 0 if isinstance(content, str) else sum(part["type"] == "image_url" for part in content)
+        return f"Stub explanation generated offline ({images} image(s) attached)."
+
+    def settings(self) -> Dict[str, Any]:
+        return {"backend": "stub"}
+
+class ExplanationCache:
+    """
+    LRU cache of explanation texts with a TTL, keyed on the normalized finding
+    set. Confidences are bucketed so near-identical studies share an entry;
+    optionally a perceptual hash of each region crop is part of the key too.
+    When `path` is set the entries are persisted to that JSON file so
+    single-shot runs and other workers can share them; every save merges
+    with what the other processes wrote since.
+    """
+    def __init__(self, max_entries: int = 512, ttl: float = 86400.0,
+                 confidence_bucket: float = 0.1, use_phash: bool = False, path: str = '') -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.confidence_bucket = confidence_bucket
+        self.use_phash = use_phash
+        self.path = path
+        self._entries = OrderedDict()  # key -> (expires_at, text)
+        self._lock = threading.Lock()
+        # Saves take this one, so lookups never wait on the file
+        self._save_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.load()
+
+    def key(self, conditions, detected_boxes, original_image) -> str:
+        findings = []
+        for condition, box in zip(conditions, detected_boxes):
+            condition_name, confidence = parse_condition(condition)
+            finding = [condition_name.strip().lower(), int(confidence / self.confidence_bucket)]
+            if self.use_phash:
+                finding.append(perceptual_hash(crop_detection(original_image, box)))
+            findings.append(finding)
+        return json.dumps(sorted(findings))
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        self.save()
+
+    def _read_file(self) -> Dict[str, Tuple[float, str]]:
+        """Unexpired entries of the file, oldest first"""
+        if not self.path or not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {key: (expires_at, text) for key, (expires_at, text) in entries if expires_at >= now}
+
+    @contextmanager
+    def _file_lock(self):
+        """Keeps other processes from replacing the file between our read and write"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self) -> None:
+        entries = self._read_file()
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._save_lock, self._file_lock():
+            # Merge with the entries other processes saved, keeping the later expiry
+            merged = self._read_file()
+            with self._lock:
+                for key, entry in self._entries.items():
+                    if key not in merged or merged[key][0] < entry[0]:
+                        merged[key] = entry
+            entries = sorted(merged.items(), key=lambda item: item[1][0])[-self.max_entries:]
+            # Write to a temporary file and rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            with os.fdopen(fd, 'w') as f:
+                json.dump([[key, list(entry)] for key, entry in entries], f)
+            os.replace(tmp_path, self.path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
+
+# Placeholder description returned while the explanation is still being generated
+EXPLANATION_PENDING = "Explanation is being generated."
+
+async def get_technical_explanation_async(backend, vision_messages, text_messages):
+    try:
         # Try to use vision model if we have regions
-        if use_vision:
+        if vision_messages is not None:
             try:
-                messages = [
-                    {"role": "system", "content": "You are a radiologist AI assistant with expertise in analyzing chest X-rays. Provide technical analysis of the detected regions."}
-                ]
-                
-                # Add the full annotated image first
-                content_parts = [
-                    {"type": "text", "text": "Chest X-ray with detected conditions. I need detailed anatomical descriptions and explanations for each finding."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{full_image_base64}"}}
-                ]
-                
-                # Add the prompt with detailed instructions
-                content_parts.append({"type": "text", "text": prompt})
-                
-                # Add the cropped regions for detailed analysis
-                for region in region_images:
-                    content_parts.append({
-                        "type": "text", 
-                        "text": f"Close-up of detected {region['condition']}. Please describe the specific anatomical location and findings:"
-                    })
-                    content_parts.append({
-                        "type": "image_url", 
-                        "image_url": {"url": f"data:image/png;base64,{region['base64_image']}"}
-                    })
-                
-                messages.append({"role": "user", "content": content_parts})
-                
-                response = client.chat.completions.create(
-                    model=vision_model,
-                    messages=messages,
-                    max_tokens=1500
-                )
-                return response.choices[0].message.content.strip()
+                return await backend.complete(vision_messages)
             except Exception as e:
                 print(f"Vision model error: {str(e)}. Falling back to text-only model.")
-                use_vision = False
         
         # Fallback to text-only if vision not supported or failed
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Using the latest model as fallback
-            messages=[
-                {"role": "system", "content": "You are a radiologist AI assistant with expertise in analyzing chest X-rays."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1500
-        )
-        return response.choices[0].message.content.strip()
+        return await backend.complete(text_messages)
     except Exception as e:
         return f"Error getting explanation: {str(e)}"
 
+def _copy_future(source: Future, target: Future) -> None:
+    """Settles target with the outcome of source"""
+    try:
+        target.set_result(source.result())
+    except BaseException as e:
+        target.set_exception(e)
+
+class ExplanationService:
+    """
+    Runs explanation requests on a background asyncio loop so callers can
+    return detections right away. At most `concurrency` requests are in
+    flight and each one is bounded by `timeout` seconds.
+    """
+    def __init__(self, backend, concurrency: int = 4, timeout: float = 60.0,
+                 cache: Optional[ExplanationCache] = None) -> None:
+        self.backend = backend
+        self.timeout = timeout
+        self.cache = cache
+        # Identical finding sets already being explained share one request
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.coalesced = 0
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def _explain(self, vision_messages, text_messages, timer=None) -> str:
+        queued = time.perf_counter()
+        async with self.semaphore:
+            if timer is not None:
+                timer.add("llm_wait", time.perf_counter() - queued)
+            with timed("llm", timer):
+                try:
+                    return await asyncio.wait_for(
+                        get_technical_explanation_async(self.backend, vision_messages, text_messages),
+                        self.timeout)
+                except asyncio.TimeoutError:
+                    return f"Error getting explanation: timed out after {self.timeout:g}s"
+
+    def submit(self, conditions, detected_boxes, original_image) -> Future:
+        """Schedule an explanation and return a Future resolving to its text"""
+        key = None
+        # Registered as in flight before the messages are built, so identical
+        # submits arriving meanwhile wait on it instead of asking again
+        future = Future()
+        # Cropping and encoding is CPU work, so it stays on the calling thread
+        # and only the network part runs on the loop
+        try:
+            if self.cache is not None:
+                key = self.cache.key(conditions, detected_boxes, original_image)
+                with self._inflight_lock:
+                    text = self.cache.get(key)
+                    if text is not None:
+                        future.set_result(text)
+                        return future
+                    if key in self._inflight:
+                        self.coalesced += 1
+                        return self._inflight[key]
+                    self._inflight[key] = future
+                future.add_done_callback(lambda done: self._store(key, done))
+            vision_messages, text_messages = build_explanation_messages(
+                conditions, detected_boxes, original_image)
+        except Exception as e:
+            future.set_result(f"Error getting explanation: {str(e)}")
+            return future
+        # The loop thread does not see this thread's context, so pass the timer along
+        request = asyncio.run_coroutine_threadsafe(
+            self._explain(vision_messages, text_messages, _current_timer.get()), self.loop)
+        request.add_done_callback(lambda done: _copy_future(done, future))
+        return future
+
+    def _store(self, key: str, future: Future) -> None:
+        # Cached before it leaves the in-flight map, so a submit in between
+        # finds one or the other
+        if future.exception() is None:
+            text = future.result()
+            # Failed explanations are transient, so do not keep them around
+            if not text.startswith("Error getting explanation"):
+                self.cache.put(key, text)
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.cache.stats() if self.cache is not None else {}
+        stats["coalesced"] = self.coalesced
+        return stats
+
+_explanation_service = None
+
+def configure_explanations(backend="openai", concurrency=4, timeout=60.0, stub_latency=0.0, cache=None):
+    global _explanation_service
+    if backend == "stub":
+        explanation_backend = StubExplanationBackend(stub_latency)
+    else:
+        explanation_backend = OpenAIExplanationBackend(timeout=timeout)
+    _explanation_service = ExplanationService(explanation_backend, concurrency, timeout, cache)
+    return _explanation_service
+
+def get_explanation_service():
+    if _explanation_service is None:
+        configure_explanations()
+    return _explanation_service
+
+# Function to get LLM explanation
+def get_technical_explanation(conditions, detected_boxes, original_image):
+    return get_explanation_service().submit(conditions, detected_boxes, original_image).result()
+
+def parse_band(spec):
+    """Parse a LOW:HIGH confidence band"""
+    try:
+        low, high = (float(value) for value in spec.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid band {spec!r}, expected LOW:HIGH")
+    return [low, high]
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Run YOLO inference on X-ray images')
-    parser.add_argument('--input', type=str, required=True, help='Path to input X-ray image')
-    parser.add_argument('--yolo-output', type=str, required=True, help='Path to save YOLO result image')
-    parser.add_argument('--heatmap-output', type=str, required=True, help='Path to save heatmap result image')
+    parser.add_argument('--input', type=str, default='', help='Path to input X-ray image (PNG/JPEG or DICOM), or a directory / manifest file (one path per line) for batch mode')
+    parser.add_argument('--yolo-output', type=str, default='', help='Path to save YOLO result image (a directory in batch mode)')
+    parser.add_argument('--heatmap-output', type=str, default='', help='Path to save heatmap result image (a directory in batch mode)')
     parser.add_argument('--model', type=str, default=os.path.join(os.path.dirname(__file__), "best.pt"), help='Path to YOLO model')
     parser.add_argument('--output-json', type=str, default='', help='Path to save JSON results (diseases and explanation)')
-    return parser.parse_args()
+    parser.add_argument('--worker', action='store_true', help='Run as a long-lived worker reading JSON jobs from stdin')
+    parser.add_argument('--concurrency', type=int, default=2, help='Number of jobs a worker processes at once')
+    parser.add_argument('--threads', type=int, default=0, help='Torch/OpenCV threads (default: one per --cpus core, or the library default)')
+    parser.add_argument('--cpus', type=parse_cpu_list, default=None, help='Pin the process to these cores, e.g. 0-3 or 0,2 (Linux only)')
+    parser.add_argument('--batch-size', type=int, default=4, help='Number of images per forward pass in batch mode')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnx', 'openvino'], help='Runtime for detection (onnx/openvino export the model next to it on first use; the heatmap always runs on torch)')
+    parser.add_argument('--check-parity', action='store_true', help='Compare the detections of --backend against torch on --input and exit')
+    parser.add_argument('--box-tolerance', type=float, default=2.0, help='Maximum box coordinate difference in pixels for --check-parity')
+    parser.add_argument('--conf-tolerance', type=float, default=0.02, help='Maximum confidence difference for --check-parity')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'int8'], help='Detection precision: bf16 autocast on --backend torch or a static INT8 model on --backend onnx (both need a passing --validate-precision run)')
+    parser.add_argument('--validate-precision', action='store_true', help='Compare --precision against fp32 on the --input reference set, enable it if it passes and exit')
+    parser.add_argument('--calibration-images', type=str, default='', help='Directory or manifest of images to calibrate the INT8 model on (quantizes during --validate-precision)')
+    parser.add_argument('--max-map-drop', type=float, default=0.02, help='Largest mAP@0.5 drop against fp32 accepted by --validate-precision')
+    parser.add_argument('--max-recall-drop', type=float, default=0.05, help='Largest per-class recall drop against fp32 accepted by --validate-precision')
+    parser.add_argument('--heatmap-mode', type=str, default='full', choices=list(HEATMAP_MODES), help='full: EigenGradCAM on six layers; fast: gradient-free EigenCAM from the forward activations; off: no heatmap')
+    parser.add_argument('--heatmap-layers', type=int, nargs='+', default=None, help='Model layers the CAM is computed on (default: per --heatmap-mode)')
+    parser.add_argument('--triage-model', type=str, default='', help='Normal/abnormal image classifier run before detection (from train_triage.py); confidently normal studies skip detection, heatmap and explanation')
+    parser.add_argument('--triage-threshold', type=float, default=0.9, help='Probability of the normal class at which a study skips detection')
+    parser.add_argument('--triage-imgsz', type=int, default=224, help='Input size of the triage classifier')
+    parser.add_argument('--triage-normal-class', type=str, default='normal', help='Name of the normal class of the triage classifier')
+    parser.add_argument('--cascade-model', type=str, default='', help='Second detector tier (e.g. YOLOv8s); --model then only runs first and ambiguous studies are escalated to this one')
+    parser.add_argument('--cascade-band', type=float, nargs=2, default=[0.2, 0.5], metavar=('LOW', 'HIGH'), help='First-tier detections with a confidence in [LOW, HIGH) escalate the study')
+    parser.add_argument('--cascade-disagreement-iou', type=float, default=0.5, help='Two first-tier detections of different classes overlapping this much escalate the study')
+    parser.add_argument('--cascade-merge-iou', type=float, default=0.5, help='IoU at which the boxes of both tiers are merged into the more confident one')
+    parser.add_argument('--evaluate-cascade', action='store_true', help='Report the accuracy/throughput trade-off of the cascade on the --input validation set (with --labels-dir) and exit')
+    parser.add_argument('--labels-dir', type=str, default='', help='YOLO label files of the --evaluate-cascade images')
+    parser.add_argument('--sweep-bands', type=parse_band, nargs='+', default=None, help='LOW:HIGH bands compared by --evaluate-cascade (default: --cascade-band)')
+    parser.add_argument('--dicom-windowing', type=str, default='max', choices=['max', 'voi'], help='DICOM intensity mapping: max matches dicom_to_png (what the model was trained on), voi uses the window / VOI LUT from the header')
+    parser.add_argument('--overlay-encoding', type=parse_encoding, default='auto:1', help='FORMAT[:QUALITY] of the detection image: png/jpeg/webp or auto (from the file extension); QUALITY is the PNG compression level 0-9 or the JPEG/WebP quality 0-100')
+    parser.add_argument('--heatmap-encoding', type=parse_encoding, default='auto:1', help='FORMAT[:QUALITY] of the heatmap image, as --overlay-encoding')
+    parser.add_argument('--llm-encoding', type=parse_encoding, default='jpeg:90', help='FORMAT[:QUALITY] of the images sent to the LLM, as --overlay-encoding')
+    parser.add_argument('--llm-max-side', type=int, default=2048, help='Downscale images sent to the LLM to this long side (0 keeps full resolution)')
+    parser.add_argument('--cache-dir', type=str, default=os.path.join(os.path.dirname(__file__), "cache"), help='Directory for cached analysis results')
+    parser.add_argument('--cache-size-mb', type=int, default=1024, help='Maximum size of the result cache in MB')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the result cache')
+    parser.add_argument('--async-explanation', action='store_true', help='Return detections first and deliver the explanation as a follow-up result')
+    parser.add_argument('--llm-backend', type=str, default=os.getenv("LLM_BACKEND", "openai"), choices=["openai", "stub"], help='Backend used for explanations (stub works offline)')
+    parser.add_argument('--llm-timeout', type=float, default=60.0, help='Timeout in seconds for one explanation')
+    parser.add_argument('--llm-concurrency', type=int, default=4, help='Maximum number of explanation requests in flight')
+    parser.add_argument('--stub-latency', type=float, default=0.0, help='Simulated latency in seconds of the stub backend')
+    parser.add_argument('--explanation-cache-size', type=int, default=512, help='Maximum number of memoized explanations (0 disables the cache)')
+    parser.add_argument('--explanation-ttl', type=float, default=86400.0, help='Seconds a memoized explanation stays valid')
+    parser.add_argument('--confidence-bucket', type=float, default=0.1, help='Width of the confidence buckets in the explanation cache key')
+    parser.add_argument('--explanation-phash', action='store_true', help='Include a perceptual hash of each region crop in the explanation cache key')
+    parser.add_argument('--explanation-cache-file', type=str, default='', help='Persist memoized explanations to this JSON file')
+    parser.add_argument('--profile', type=str, default='', choices=['', 'cprofile', 'torch'], help='Profile the run with cProfile or torch.profiler')
+    parser.add_argument('--import-report', action='store_true', help='Print the cold-start import time per stage (core, heatmap, explanation, dicom) to stderr on exit')
+    parser.add_argument('--profile-output', type=str, default='', help='Where to write the profile (default: profile.prof / trace.json next to --output-json)')
+    args = parser.parse_args()
+    args.cache = None if args.no_cache else ResultCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+    if args.precision == 'bf16' and args.backend != 'torch':
+        parser.error('--precision bf16 runs on --backend torch')
+    if args.precision == 'int8' and args.backend != 'onnx':
+        parser.error('--precision int8 runs on --backend onnx')
+    if args.evaluate_cascade:
+        if not (args.input and args.labels_dir and args.cascade_model):
+            parser.error('--evaluate-cascade needs --input, --labels-dir and --cascade-model')
+    elif args.validate_precision:
+        if not args.input or args.precision == 'fp32':
+            parser.error('--validate-precision needs --input and a bf16 or int8 --precision')
+    elif args.check_parity:
+        if not args.input or args.backend == 'torch':
+            parser.error('--check-parity needs --input and an onnx or openvino --backend')
+    elif not args.worker and not (args.input and args.yolo_output and args.heatmap_output):
+        parser.error('--input, --yolo-output and --heatmap-output are required unless --worker is set')
+    return args
 
-def main():
-    args = parse_args()
-    
-    # Check if input file exists
-    if not os.path.isfile(args.input):
-        print(f"Error: Input file {args.input} does not exist")
-        sys.exit(1)
-    
-    # Create output directories if needed
-    os.makedirs(os.path.dirname(args.yolo_output), exist_ok=True)
-    os.makedirs(os.path.dirname(args.heatmap_output), exist_ok=True)
-    
-    # Run YOLO inference
-    yolo_success, detected_conditions, detected_boxes = run_yolo_inference(args.input, args.yolo_output, args.model)
-    if not yolo_success:
-        print("Error: YOLO inference failed")
-        sys.exit(1)
-    
+def save_results(results, output_json):
+    if output_json:
+        with open(output_json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+# Image extensions picked up when --input is a directory
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg') + DICOM_EXTENSIONS
+
+def is_batch_input(input_path):
+    return os.path.isdir(input_path) or input_path.endswith(('.txt', '.lst'))
+
+def list_batch_inputs(input_path):
+    """Image paths from a directory or from a manifest file with one path per line"""
+    if os.path.isdir(input_path):
+        return [
+            os.path.join(input_path, name)
+            for name in sorted(os.listdir(input_path))
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+    base_dir = os.path.dirname(os.path.abspath(input_path))
+    with open(input_path) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base_dir, line) for line in lines if line and not line.startswith('#')]
+
+# Fields that describe one request rather than the analysis; never stored in the cache
+REQUEST_FIELDS = ("cache", "timings", "explanation_pending")
+
+def cache_results(cache, key, results, yolo_output, heatmap_output):
+    # Failed explanations are transient, so do not keep them around
+    if cache is not None and not results["description"].startswith("Error getting explanation"):
+        cache.put(key, {k: v for k, v in results.items() if k not in REQUEST_FIELDS}, yolo_output, heatmap_output)
+
+def stage_verdicts(context):
+    """The triage and cascade verdicts on an ImageContext, for the result dict"""
+    return {stage: getattr(context, stage) for stage in ("triage", "cascade") if getattr(context, stage) is not None}
+
+def build_results(context, heatmap_output, detected_conditions, detected_boxes):
+    """
+    Turn detections on an ImageContext into the result dict and schedule the
+    explanation. Returns
+    (results, explanation) where explanation is a Future resolving to the
+    explanation text, or None when there is nothing to explain.
+    """
     # Check if any diseases were detected
     if not detected_conditions or len(detected_conditions) == 0:
-        # No diseases detected - create results and exit
+        # No diseases detected
         results = {
             "disease": "No Abnormality Detected",
             "disease_names": ["No abnormalities detected"],
             "description": "No abnormalities were detected in this chest X-ray."
         }
-        
-        # Save results to JSON file if requested
-        if args.output_json:
-            with open(args.output_json, 'w') as f:
-                json.dump(results, f, indent=2)
-        
-        # Print the results to stdout for capturing in Node.js
-        print(json.dumps(results))
-        print("No abnormalities detected in the X-ray")
-        sys.exit(0)
-    
-    # Create heatmap object
-    heatmap_model = yolov8_heatmap(
-        weight=args.model,
-        conf_threshold=0.2,
-        method="EigenGradCAM",
-        layer=[10, 12, 14, 16, 18, -3],
-        ratio=0.02,
-        show_box=True,
-        renormalize=False,
-    )
-
-    # Generate and save heatmap
-    try:
-        heatmap_success = heatmap_model.save_result(args.input, args.heatmap_output)
-        if not heatmap_success:
-            print("Warning: Heatmap generation failed, continuing with YOLO results only")
-            # Continue with processing without heatmap
-    except Exception as e:
-        print(f"Warning: Heatmap generation error: {str(e)}, continuing with YOLO results only")
-        # Continue with processing without heatmap
+        results.update(stage_verdicts(context))
+        return results, None
+    
+    if HEATMAP_SETTINGS["mode"] != "off" and not os.path.isfile(heatmap_output):
+        print("Warning: Heatmap generation failed, continuing with YOLO results only")
     
     # Process results
     # Get disease names (without confidence values)
@@ -557,27 +2064,677 @@ def main():
     category = "Other Diseases"  # Default category when conditions are detected
     
     # Generate report if we have detected conditions
-    # Get original image for explanation
-    _, _, original_image = preprocess_image(args.input)
-    explanation = get_technical_explanation(detected_conditions, detected_boxes, original_image)
+    # The explanation crops the original image, so bring the boxes over from the detector's resize
+    explanation = get_explanation_service().submit(
+        detected_conditions, context.original_boxes(detected_boxes), context.original)
     
     # Create result dictionary
     results = {
         "disease": category,
         "disease_names": disease_names,
-        "description": explanation
+        "description": EXPLANATION_PENDING,
+        "explanation_pending": True
     }
+    results.update(stage_verdicts(context))
+    return results, explanation
+
+def chain_explanation(results, explanation, finish):
+    """Future resolving to finish(results with the explanation filled in)"""
+    final = Future()
+
+    def done(future):
+        try:
+            final_results = {k: v for k, v in results.items() if k != "explanation_pending"}
+            final_results["description"] = future.result()
+            final.set_result(finish(final_results))
+        except Exception as e:
+            final.set_exception(e)
+
+    explanation.add_done_callback(done)
+    return final
+
+def start_analysis(input_path, yolo_output, heatmap_output, model_path, output_json='', cache=None):
+    """
+    Run detection and heatmap for one X-ray and schedule its explanation.
+    Returns (results, explanation): explanation is None when results is
+    already final, otherwise a Future resolving to the final result dict while
+    results["description"] is a placeholder. With a ResultCache, results for
+    an already analyzed image are served from disk; the "cache" field reports
+    "hit" or "miss". The "timings" field holds the per-stage timings.
+    """
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        return _start_analysis(input_path, yolo_output, heatmap_output, model_path, output_json, cache, timer)
+    finally:
+        _current_timer.reset(token)
+
+def _start_analysis(input_path, yolo_output, heatmap_output, model_path, output_json, cache, timer):
+    # Check if input file exists
+    if not os.path.isfile(input_path):
+        raise FileNotFoundError(f"Input file {input_path} does not exist")
     
-    # Save results to JSON file if requested
-    if args.output_json:
-        with open(args.output_json, 'w') as f:
-            json.dump(results, f, indent=2)
+    # Create output directories if needed
+    os.makedirs(os.path.dirname(yolo_output) or ".", exist_ok=True)
+    os.makedirs(os.path.dirname(heatmap_output) or ".", exist_ok=True)
     
-    # Also print the results to stdout for capturing in Node.js
-    print(json.dumps(results))
+    if cache is not None:
+        with timed("cache_lookup"):
+            cache_key = cache.key(input_path, model_path, result_settings())
+            results = cache.get(cache_key, yolo_output, heatmap_output)
+        if results is not None:
+            results["cache"] = "hit"
+            results["timings"] = timer.report()
+            save_results(results, output_json)
+            return results, None
+    
+    context = ImageContext(input_path)
+    # Decode before taking the model lock so other requests can use the model meanwhile
+    if context.rgb is None:
+        raise RuntimeError("YOLO inference failed")
+    
+    with _model_lock:
+        # Run YOLO inference; the heatmap comes from the same forward pass
+        yolo_success, detected_conditions, detected_boxes = run_yolo_inference(
+            context, yolo_output, model_path, heatmap_output)
+        if not yolo_success:
+            raise RuntimeError("YOLO inference failed")
+    
+    def finish(results):
+        if cache is not None:
+            cache_results(cache, cache_key, results, yolo_output, heatmap_output)
+            results["cache"] = "miss"
+        results["timings"] = timer.report()
+        save_results(results, output_json)
+        return results
+    
+    results, explanation = build_results(context, heatmap_output, detected_conditions, detected_boxes)
+    if explanation is None:
+        return finish(results), None
+    
+    if cache is not None:
+        results["cache"] = "miss"
+    results["timings"] = timer.report()
+    # Save the placeholder before chaining so the final result always overwrites it
+    save_results(results, output_json)
+    return results, chain_explanation(results, explanation, finish)
+
+def analyze_xray(input_path, yolo_output, heatmap_output, model_path, output_json='', cache=None):
+    """Run detection, heatmap and explanation for one X-ray and return the final result dict"""
+    results, explanation = start_analysis(
+        input_path, yolo_output, heatmap_output, model_path, output_json, cache)
+    return results if explanation is None else explanation.result()
+
+def analyze_xray_batch(input_paths, yolo_dir, heatmap_dir, model_path, batch_size=4, cache=None):
+    """
+    Batch version of analyze_xray. Result images are written to yolo_dir and
+    heatmap_dir as <name>_yolo.png / <name>_heatmap.png (<name>_<path hash>
+    for inputs that share a name). Returns one entry per input: the result
+    dict with an "input" key, or {"input", "error"}.
+    Explanations for the batch are requested concurrently. Stages run for the
+    whole batch at once, so every entry carries the batch's "timings".
+    """
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        return _analyze_xray_batch(input_paths, yolo_dir, heatmap_dir, model_path, batch_size, cache, timer)
+    finally:
+        _current_timer.reset(token)
+
+def _analyze_xray_batch(input_paths, yolo_dir, heatmap_dir, model_path, batch_size, cache, timer):
+    os.makedirs(yolo_dir, exist_ok=True)
+    os.makedirs(heatmap_dir, exist_ok=True)
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in input_paths]
+    # Inputs from different directories can share a name; give those a hash of
+    # their path so one image's outputs never overwrite another's
+    counts = Counter(stems)
+    stems = [
+        f"{stem}_{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]}" if counts[stem] > 1 else stem
+        for stem, path in zip(stems, input_paths)
+    ]
+    yolo_outputs = [os.path.join(yolo_dir, f"{stem}_yolo.png") for stem in stems]
+    heatmap_outputs = [os.path.join(heatmap_dir, f"{stem}_heatmap.png") for stem in stems]
+    
+    # Serve what we can from the cache and only run the model on the rest
+    batch_results = [None] * len(input_paths)
+    cache_keys = [None] * len(input_paths)
+    if cache is not None:
+        for i, input_path in enumerate(input_paths):
+            if not os.path.isfile(input_path):
+                continue
+            with timed("cache_lookup"):
+                cache_keys[i] = cache.key(input_path, model_path, result_settings())
+                results = cache.get(cache_keys[i], yolo_outputs[i], heatmap_outputs[i])
+            if results is not None:
+                batch_results[i] = {"input": input_path, **results, "cache": "hit"}
+    misses = [i for i, results in enumerate(batch_results) if results is None]
+    
+    contexts = {i: ImageContext(input_paths[i]) for i in misses}
+    detections = []
+    if misses:
+        with _model_lock:
+            detections = run_yolo_inference_batch(
+                [contexts[i] for i in misses],
+                [yolo_outputs[i] for i in misses],
+                model_path,
+                [heatmap_outputs[i] for i in misses],
+                batch_size)
     
-    print("Successfully generated all results")
-    sys.exit(0)
+    def finish(i, results):
+        if cache is not None:
+            cache_results(cache, cache_keys[i], results, yolo_outputs[i], heatmap_outputs[i])
+            results["cache"] = "miss"
+        batch_results[i] = {"input": input_paths[i], **results}
+        return results
+    
+    pending = []
+    for i, (yolo_success, detected_conditions, detected_boxes) in zip(misses, detections):
+        if not yolo_success:
+            batch_results[i] = {"input": input_paths[i], "error": "YOLO inference failed"}
+            continue
+        results, explanation = build_results(contexts[i], heatmap_outputs[i], detected_conditions, detected_boxes)
+        if explanation is None:
+            finish(i, results)
+        else:
+            pending.append(chain_explanation(results, explanation, lambda r, i=i: finish(i, r)))
+    for explanation in pending:
+        explanation.result()
+    timings = timer.report()
+    for results in batch_results:
+        results["timings"] = timings
+    return batch_results
+
+# Function to match two sets of [x1, y1, x2, y2, conf, cls] detections
+def match_detections(reference, candidate, box_tolerance, conf_tolerance):
+    """
+    Greedily pair each reference detection with the closest unused candidate
+    of the same class. Returns (matched, max_box_diff, max_conf_diff) over the
+    pairs that are within both tolerances.
+    """
+    reference = reference.cpu().numpy()
+    candidate = candidate.cpu().numpy()
+    if len(reference) == 0 or len(candidate) == 0:
+        return 0, 0.0, 0.0
+    box_diff = np.abs(reference[:, None, :4] - candidate[None, :, :4]).max(-1)
+    conf_diff = np.abs(reference[:, None, 4] - candidate[None, :, 4])
+    valid = ((reference[:, None, 5] == candidate[None, :, 5])
+             & (box_diff <= box_tolerance) & (conf_diff <= conf_tolerance))
+    box_diff = np.where(valid, box_diff, np.inf)
+    matched, max_box_diff, max_conf_diff = 0, 0.0, 0.0
+    for i in np.argsort(-reference[:, 4]):
+        j = int(np.argmin(box_diff[i]))
+        if not np.isfinite(box_diff[i, j]):
+            continue
+        matched += 1
+        max_box_diff = max(max_box_diff, float(box_diff[i, j]))
+        max_conf_diff = max(max_conf_diff, float(conf_diff[i, j]))
+        box_diff[:, j] = np.inf
+    return matched, max_box_diff, max_conf_diff
+
+def check_backend_parity(input_paths, model_path, backend, box_tolerance=2.0, conf_tolerance=0.02):
+    """
+    Run detection on torch and on the exported `backend` and check that every
+    image gets the same detections, with boxes within box_tolerance pixels and
+    confidences within conf_tolerance.
+    """
+    reference_model = get_heatmap_model(model_path, "torch")
+    candidate_model = get_heatmap_model(model_path, backend)
+    images = []
+    for input_path in input_paths:
+        context = ImageContext(input_path)
+        if context.rgb is None:
+            continue
+        reference, _ = reference_model.process(context, with_cam=False)
+        candidate, _ = candidate_model.process(context, with_cam=False)
+        matched, max_box_diff, max_conf_diff = match_detections(
+            reference, candidate, box_tolerance, conf_tolerance)
+        images.append({
+            "input": input_path,
+            "torch": len(reference),
+            backend: len(candidate),
+            "matched": matched,
+            "max_box_diff": round(max_box_diff, 3),
+            "max_conf_diff": round(max_conf_diff, 4),
+            "ok": matched == len(reference) == len(candidate),
+        })
+    return {
+        "backend": backend,
+        "box_tolerance": box_tolerance,
+        "conf_tolerance": conf_tolerance,
+        "ok": bool(images) and all(image["ok"] for image in images),
+        "images": images,
+    }
+
+# -------------------- Precision Validation --------------------
+
+def validation_marker_path(model_path, precision):
+    return os.path.splitext(os.path.abspath(model_path))[0] + f".{precision}.validation.json"
+
+def precision_fingerprint(model_path, backend, precision):
+    """What a validation applies to: the backend, the checkpoint and the INT8 model if any"""
+    def file_version(path):
+        stat = os.stat(path)
+        return [stat.st_mtime, stat.st_size]
+    artifact = quantized_model_path(model_path) if precision == "int8" else None
+    return {
+        "backend": backend,
+        "checkpoint": file_version(model_path),
+        "artifact": file_version(artifact) if artifact and os.path.isfile(artifact) else None,
+    }
+
+def check_precision_validated(model_path, backend, precision):
+    """Refuse reduced precision unless a passing --validate-precision run exists for this checkpoint"""
+    if precision == "fp32":
+        return
+    try:
+        with open(validation_marker_path(model_path, precision)) as f:
+            validation = json.load(f)
+    except (OSError, ValueError):
+        validation = None
+    if (validation is None or not validation.get("ok")
+            or validation.get("fingerprint") != precision_fingerprint(model_path, backend, precision)):
+        raise RuntimeError(
+            f"{precision} inference is not validated for {model_path}; "
+            f"run --validate-precision --precision {precision} --backend {backend} first")
+
+# Function to mark each detection as a true positive against the reference detections
+def match_to_reference(reference, candidate, iou_threshold):
+    """
+    Greedily, in order of confidence, match each candidate detection to the
+    unmatched reference detection of the same class it overlaps most.
+    Returns a bool array, True for candidates with IoU >= iou_threshold.
+    """
+    tp = np.zeros(len(candidate), dtype=bool)
+    if len(reference) == 0 or len(candidate) == 0:
+        return tp
+    iou = box_iou(candidate[:, :4], reference[:, :4]).cpu().numpy()
+    iou[candidate[:, 5].cpu().numpy()[:, None] != reference[:, 5].cpu().numpy()[None, :]] = 0.0
+    for i in np.argsort(-candidate[:, 4].cpu().numpy()):
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] >= iou_threshold:
+            tp[i] = True
+            iou[:, j] = 0.0
+    return tp
+
+# Function to add one image's detections to the per-class matches read by average_precision
+def accumulate_matches(per_class, reference, candidate, iou_threshold):
+    tp = match_to_reference(reference, candidate, iou_threshold)
+    for cls in set(reference[:, 5].tolist()) | set(candidate[:, 5].tolist()):
+        stats = per_class.setdefault(int(cls), {"reference": 0, "conf": [], "tp": []})
+        stats["reference"] += int((reference[:, 5] == cls).sum())
+        mask = (candidate[:, 5] == cls).cpu().numpy()
+        stats["conf"].extend(candidate[:, 4].cpu().numpy()[mask].tolist())
+        stats["tp"].extend(tp[mask].tolist())
+
+# Function to compute the recall and AP of each class that has reference detections
+def average_precision(per_class, names):
+    classes = {}
+    for cls, stats in sorted(per_class.items()):
+        if stats["reference"] == 0:
+            continue
+        order = np.argsort(-np.array(stats["conf"]))
+        tp = np.array(stats["tp"], dtype=bool)[order]
+        tp_cumsum = np.cumsum(tp)
+        recall_curve = tp_cumsum / stats["reference"]
+        precision_curve = tp_cumsum / np.arange(1, len(tp) + 1)
+        ap = compute_ap(recall_curve, precision_curve)[0] if len(tp) else 0.0
+        classes[names[cls]] = {
+            "reference": stats["reference"],
+            "detected": len(tp),
+            "recall": round(float(tp.sum()) / stats["reference"], 4),
+            "ap50": round(float(ap), 4),
+        }
+    return classes
+
+def validate_precision(input_paths, model_path, backend, precision, calibration_paths=None,
+                       max_map_drop=0.02, max_recall_drop=0.05, iou_threshold=0.5):
+    """
+    Compare the detections at `precision` against fp32 torch on a reference set,
+    treating the fp32 detections as ground truth. The mode passes when mAP@0.5
+    is within max_map_drop of 1 and no class loses more than max_recall_drop of
+    its recall. For int8 the model is (re)quantized first when calibration
+    images are given. The report is saved as the validation marker that
+    enables the precision for this checkpoint.
+    """
+    if precision == "int8" and calibration_paths:
+        quantize_model(model_path, get_heatmap_model(model_path, "torch", "fp32").imgsz, calibration_paths)
+    reference_model = get_heatmap_model(model_path, "torch", "fp32")
+    # Built directly since get_heatmap_model refuses precisions that are not validated yet
+    candidate_model = yolov8_heatmap(
+        weight=model_path, backend=backend, precision=precision, **HEATMAP_SETTINGS)
+    
+    per_class = {}
+    images = 0
+    for input_path in input_paths:
+        context = ImageContext(input_path)
+        if context.rgb is None:
+            continue
+        images += 1
+        reference, _ = reference_model.process(context, with_cam=False)
+        candidate, _ = candidate_model.process(context, with_cam=False)
+        accumulate_matches(per_class, reference, candidate, iou_threshold)
+    candidate_model.release()
+    
+    classes = average_precision(per_class, reference_model.model_names)
+    map50 = float(np.mean([c["ap50"] for c in classes.values()])) if classes else 0.0
+    min_recall = min((c["recall"] for c in classes.values()), default=0.0)
+    report = {
+        "backend": backend,
+        "precision": precision,
+        "images": images,
+        "map50": round(map50, 4),
+        "map_drop": round(1.0 - map50, 4),
+        "max_recall_drop": round(1.0 - min_recall, 4),
+        "thresholds": {"map_drop": max_map_drop, "recall_drop": max_recall_drop, "iou": iou_threshold},
+        "classes": classes,
+        # Without any fp32 detections there is nothing to compare against
+        "ok": bool(classes) and 1.0 - map50 <= max_map_drop and 1.0 - min_recall <= max_recall_drop,
+        "fingerprint": precision_fingerprint(model_path, backend, precision),
+    }
+    with open(validation_marker_path(model_path, precision), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+# -------------------- Cascade Evaluation --------------------
+
+# Function to read the YOLO label file of an image as [x1, y1, x2, y2, 1, cls] detections
+def read_yolo_labels(labels_dir, input_path, width, height):
+    label_file = os.path.join(labels_dir, os.path.splitext(os.path.basename(input_path))[0] + ".txt")
+    # Images without findings have an empty label file, or none
+    rows = np.loadtxt(label_file, ndmin=2) if os.path.isfile(label_file) and os.path.getsize(label_file) else np.zeros((0, 5))
+    if rows.size == 0:
+        return torch.zeros((0, 6))
+    cls, x, y, w, h = rows.T
+    boxes = np.stack([(x - w / 2) * width, (y - h / 2) * height, (x + w / 2) * width, (y + h / 2) * height,
+                      np.ones(len(rows)), cls], axis=1)
+    return torch.from_numpy(boxes).float()
+
+def evaluate_cascade(input_paths, labels_dir, model_path, cascade_model_path, bands=None, iou_threshold=0.5):
+    """
+    Accuracy/throughput trade-off of the cascade on a labelled validation set
+    (the YOLO label files of preprocess_dataset.py, matched to the images by
+    name). Both tiers run detection on every image once; each band is then
+    replayed from those results, costing the first tier's time plus the
+    second tier's for the studies it escalates. Reports mAP@0.5, recall,
+    escalation rate and detection ms per image for each tier alone and for
+    each band, and for the bands the first-tier detections the merges
+    dropped and the studies they cleared of findings. Only detection is
+    timed; the heatmap costs the same whichever tier it comes from.
+    """
+    first_model = get_heatmap_model(model_path)
+    second_model = get_heatmap_model(cascade_model_path)
+    if first_model.model_names != second_model.model_names:
+        raise ValueError("The cascade models must be trained on the same classes")
+    bands = bands or [CASCADE_SETTINGS["band"]]
+    
+    def detect(model, context):
+        started = time.perf_counter()
+        detections, _ = model.process(context, with_cam=False)
+        return detections, time.perf_counter() - started
+    
+    images = []
+    for input_path in input_paths:
+        context = ImageContext(input_path)
+        if context.rgb is None:
+            continue
+        if not images:
+            # One untimed pass each so lazy initialization does not count
+            detect(first_model, context)
+            detect(second_model, context)
+        height, width = context.rgb.shape[:2]
+        images.append((read_yolo_labels(labels_dir, input_path, width, height),
+                       *detect(first_model, context), *detect(second_model, context)))
+    
+    def configuration(name, band, pick):
+        per_class = {}
+        seconds = escalated = dropped = cleared = 0
+        for labels, first, first_seconds, second, second_seconds in images:
+            detections, cost, escalate, drop = pick(first, first_seconds, second, second_seconds)
+            accumulate_matches(per_class, labels, detections, iou_threshold)
+            seconds += cost
+            escalated += escalate
+            dropped += drop
+            cleared += int(escalate and len(first) > 0 and len(detections) == 0)
+        classes = average_precision(per_class, first_model.model_names)
+        references = sum(c["reference"] for c in classes.values())
+        report = {
+            "name": name,
+            "band": band,
+            "map50": round(float(np.mean([c["ap50"] for c in classes.values()])) if classes else 0.0, 4),
+            "recall": round(sum(c["recall"] * c["reference"] for c in classes.values()) / references, 4) if references else 0.0,
+            "escalation_rate": round(escalated / len(images), 4) if images else 0.0,
+            "ms_per_image": round(seconds * 1000 / len(images), 2) if images else 0.0,
+            "images_per_second": round(len(images) / seconds, 2) if seconds else 0.0,
+        }
+        if band is not None:
+            report["dropped_detections"] = dropped
+            report["cleared_rate"] = round(cleared / len(images), 4) if images else 0.0
+        return report
+    
+    def cascade(band):
+        def pick(first, first_seconds, second, second_seconds):
+            if escalation_reason(first, band) is None:
+                return first, first_seconds, 0, 0
+            merged, _, dropped = merge_detections(first, second, band)
+            return merged, first_seconds + second_seconds, 1, dropped
+        return pick
+    
+    configurations = [
+        configuration("first_tier", None, lambda first, t1, second, t2: (first, t1, 0, 0)),
+        configuration("second_tier", None, lambda first, t1, second, t2: (second, t2, 1, 0)),
+    ] + [configuration("cascade", list(band), cascade(band)) for band in bands]
+    return {
+        "models": [model_path, cascade_model_path],
+        "images": len(images),
+        "labelled_boxes": sum(len(labels) for labels, *_ in images),
+        "iou_threshold": iou_threshold,
+        "disagreement_iou": CASCADE_SETTINGS["disagreement_iou"],
+        "merge_iou": CASCADE_SETTINGS["merge_iou"],
+        "configurations": configurations,
+    }
+
+def run_worker(args):
+    """
+    Serve jobs from stdin until EOF. Each input line is a JSON object with
+    "id", "input", "yolo_output", "heatmap_output" and optionally "output_json";
+    each output line is {"id", "ok", "result"} or {"id", "ok", "error"}.
+    With --async-explanation a result with "explanation_pending" is followed
+    by {"id", "type": "explanation", "ok", "result"} carrying the final result.
+    A {"id", "type": "stats"} line is answered with the cache, triage and cascade counters.
+    A job may carry a "deadline" (epoch milliseconds); it fails without
+    running if it is only picked up after that.
+    """
+    # Keep the real stdout for the protocol and send everything else
+    # (prints, ultralytics logging) to stderr
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1)
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    write_lock = threading.Lock()
+
+    def send(message):
+        with write_lock:
+            protocol_out.write(json.dumps(message) + "\n")
+            protocol_out.flush()
+
+    def send_explanation(job_id, explanation):
+        try:
+            send({"id": job_id, "type": "explanation", "ok": True, "result": explanation.result()})
+        except Exception as e:
+            send({"id": job_id, "type": "explanation", "ok": False, "error": str(e)})
+
+    def handle(job):
+        job_id = job.get("id")
+        # The caller has given up on jobs that waited here past their deadline
+        if job.get("deadline") and time.time() * 1000 > job["deadline"]:
+            send({"id": job_id, "ok": False, "error": "Deadline exceeded before the job started"})
+            return
+        try:
+            results, explanation = start_analysis(
+                job["input"],
+                job["yolo_output"],
+                job["heatmap_output"],
+                job.get("model", args.model),
+                job.get("output_json", ""),
+                args.cache,
+            )
+            if explanation is not None and not args.async_explanation:
+                results, explanation = explanation.result(), None
+            send({"id": job_id, "ok": True, "result": results})
+        except Exception as e:
+            send({"id": job_id, "ok": False, "error": str(e)})
+            return
+        # The explanation follows as a second message for the same id
+        if explanation is not None:
+            explanation.add_done_callback(lambda future: send_explanation(job_id, future))
+
+    # Load the weights before accepting jobs
+    get_heatmap_model(args.model)
+    if TRIAGE_SETTINGS["model"]:
+        model_registry.get(TRIAGE_SETTINGS["model"])
+    if CASCADE_SETTINGS["model"]:
+        get_heatmap_model(CASCADE_SETTINGS["model"])
+    send({"type": "ready", **thread_placement(), "imports_ms": import_report()})
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                send({"id": None, "ok": False, "error": f"Invalid job: {str(e)}"})
+                continue
+            if job.get("type") == "stats":
+                send({"id": job.get("id"), "type": "stats", "ok": True,
+                      "result": {"explanations": get_explanation_service().stats(),
+                                 "triage": triage_stats.stats(),
+                                 "cascade": cascade_stats.stats()}})
+                continue
+            pool.submit(handle, job)
+
+@contextmanager
+def profiling(kind, output_path):
+    """Profile the enclosed block with cProfile or torch.profiler and write it to output_path"""
+    global _record_functions
+    if not kind:
+        yield
+        return
+    if kind == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output_path)
+            print(f"Profile written to {output_path}", file=sys.stderr)
+        return
+    _record_functions = True
+    try:
+        with torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True) as profiler:
+            yield
+    finally:
+        _record_functions = False
+    profiler.export_chrome_trace(output_path)
+    print(f"Profile written to {output_path}", file=sys.stderr)
+
+def run(args):
+    """Run the worker, a batch or a single image and return the exit code"""
+    if args.validate_precision:
+        input_paths = list_batch_inputs(args.input) if is_batch_input(args.input) else [args.input]
+        calibration_paths = list_batch_inputs(args.calibration_images) if args.calibration_images else None
+        report = validate_precision(
+            input_paths, args.model, args.backend, args.precision, calibration_paths,
+            args.max_map_drop, args.max_recall_drop)
+        save_results(report, args.output_json)
+        print(json.dumps(report))
+        return 0 if report["ok"] else 1
+
+    try:
+        check_precision_validated(args.model, args.backend, args.precision)
+    except RuntimeError as e:
+        print(f"Error: {str(e)}")
+        return 1
+
+    if args.evaluate_cascade:
+        input_paths = list_batch_inputs(args.input) if is_batch_input(args.input) else [args.input]
+        report = evaluate_cascade(
+            input_paths, args.labels_dir, args.model, args.cascade_model, args.sweep_bands)
+        save_results(report, args.output_json)
+        print(json.dumps(report))
+        return 0
+
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    if args.check_parity:
+        input_paths = list_batch_inputs(args.input) if is_batch_input(args.input) else [args.input]
+        report = check_backend_parity(
+            input_paths, args.model, args.backend, args.box_tolerance, args.conf_tolerance)
+        save_results(report, args.output_json)
+        print(json.dumps(report))
+        return 0 if report["ok"] else 1
+
+    if is_batch_input(args.input):
+        input_paths = list_batch_inputs(args.input)
+        batch_results = analyze_xray_batch(
+            input_paths, args.yolo_output, args.heatmap_output, args.model, args.batch_size, args.cache)
+        save_results(batch_results, args.output_json)
+        print(json.dumps(batch_results))
+        return 0
+    
+    try:
+        results, explanation = start_analysis(
+            args.input, args.yolo_output, args.heatmap_output, args.model, args.output_json, args.cache)
+        if explanation is not None:
+            if args.async_explanation:
+                # Detections first, the final result follows on its own line
+                print(json.dumps(results), flush=True)
+            results = explanation.result()
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return 1
+    
+    # Print the results to stdout for capturing in Node.js
+    print(json.dumps(results))
+    if results["disease"] == "No Abnormality Detected":
+        print("No abnormalities detected in the X-ray")
+    else:
+        print("Successfully generated all results")
+    return 0
+
+def main():
+    args = parse_args()
+    # Before any model is loaded, so the thread pools start at their final size
+    configure_threads(args.threads, args.cpus)
+    explanation_cache = None
+    if args.explanation_cache_size > 0:
+        explanation_cache = ExplanationCache(
+            args.explanation_cache_size, args.explanation_ttl, args.confidence_bucket,
+            args.explanation_phash, args.explanation_cache_file)
+    configure_explanations(
+        args.llm_backend, args.llm_concurrency, args.llm_timeout, args.stub_latency, explanation_cache)
+    configure_detector(args.backend, args.precision)
+    configure_heatmap(args.heatmap_mode, args.heatmap_layers)
+    configure_decoding(args.dicom_windowing)
+    configure_triage(args.triage_model or None, args.triage_threshold, args.triage_imgsz, args.triage_normal_class)
+    configure_cascade(args.cascade_model or None, args.cascade_band, args.cascade_disagreement_iou, args.cascade_merge_iou)
+    configure_encoding("overlay", *args.overlay_encoding)
+    configure_encoding("heatmap", *args.heatmap_encoding)
+    configure_encoding("llm", *args.llm_encoding, max_side=args.llm_max_side or None)
+
+    profile_output = args.profile_output or os.path.join(
+        os.path.dirname(args.output_json),
+        "profile.prof" if args.profile == "cprofile" else "trace.json")
+    with profiling(args.profile, profile_output):
+        exit_code = run(args)
+    if args.import_report:
+        print(json.dumps({"imports_ms": import_report()}), file=sys.stderr)
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
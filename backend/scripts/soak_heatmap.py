@@ -0,0 +1,113 @@
+import argparse
+import ctypes
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+import model_results as mr
+from benchmark import current_rss_mb, prepare_inputs
+
+# Soak test of the heatmap engine: one yolov8_heatmap processes thousands of
+# images in a row while RSS and the number of hooks on the model are sampled.
+# Fails (exit code 1) when RSS grows by more than --max-growth-mb after warmup
+# or hooks pile up. glibc keeps freed heap mapped, so raw RSS wanders by a few
+# hundred MB with the allocator; the growth is judged on the RSS after handing
+# the free heap back (malloc_trim), the raw RSS is reported next to it.
+#
+#   python soak_heatmap.py --model best.pt --images 5000 --output soak.json
+
+try:
+    _libc = ctypes.CDLL("libc.so.6")
+except OSError:  # not glibc
+    _libc = None
+
+# Function to sample the RSS before and after returning the free heap to the OS
+def sample_rss():
+    rss = current_rss_mb()
+    if _libc is None or not hasattr(_libc, "malloc_trim"):
+        return round(rss, 1), round(rss, 1)
+    _libc.malloc_trim(0)
+    return round(rss, 1), round(current_rss_mb(), 1)
+
+# Function to count the hooks registered on a module and its children
+def count_hooks(model):
+    return sum(len(m._forward_hooks) + len(m._forward_pre_hooks) + len(m._backward_hooks) for m in model.modules())
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check that the heatmap engine runs in flat memory')
+    parser.add_argument('--model', type=str, default=os.path.join(os.path.dirname(__file__), "best.pt"), help='Path to YOLO model')
+    parser.add_argument('--input', type=str, default='', help='Directory of X-rays to cycle through (default: synthetic images)')
+    parser.add_argument('--distinct', type=int, default=16, help='Distinct images to cycle through')
+    parser.add_argument('--resolution', type=str, default='1024', help='Long side of the inputs, or native (with --input)')
+    parser.add_argument('--images', type=int, default=2000, help='Images to process')
+    parser.add_argument('--warmup', type=int, default=50, help='Images processed before the baseline RSS is taken')
+    parser.add_argument('--sample-every', type=int, default=100, help='Sample RSS every N images')
+    parser.add_argument('--heatmap-mode', type=str, default='full', choices=[m for m in mr.HEATMAP_MODES if m != "off"])
+    parser.add_argument('--batch-size', type=int, default=1, help='Images per process_batch call')
+    parser.add_argument('--threads', type=int, default=0, help='Torch threads (default: the torch default)')
+    parser.add_argument('--max-growth-mb', type=float, default=32.0, help='Largest RSS growth after warmup that passes')
+    parser.add_argument('--output', type=str, default='', help='Path to save the JSON report')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    mr.configure_threads(args.threads)
+    mr.configure_heatmap(args.heatmap_mode)
+    heatmap = mr.yolov8_heatmap(weight=args.model, **mr.HEATMAP_SETTINGS)
+    hooks_at_start = count_hooks(heatmap.model)
+
+    samples = []
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = prepare_inputs(work_dir, args.resolution, args.input, args.distinct)
+        if not paths:
+            print("No input images found")
+            return 1
+        baseline = None
+        for start in range(0, args.warmup + args.images, args.batch_size):
+            batch = [paths[i % len(paths)] for i in range(start, start + args.batch_size)]
+            heatmap.process_batch([mr.ImageContext(path) for path in batch], with_cam=True)
+            done = start + args.batch_size
+            if baseline is None and done >= args.warmup:
+                baseline = sample_rss()
+                samples.append((0, *baseline))
+            elif baseline is not None and (done - args.warmup) % args.sample_every < args.batch_size:
+                samples.append((done - args.warmup, *sample_rss()))
+                print(f"{done - args.warmup} images, RSS {samples[-1][1]} MB, {samples[-1][2]} MB trimmed", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+
+    processed, raw_rss, rss = np.array(samples, dtype=np.float64).T
+    # Least-squares trend, so one late allocator spike does not decide it alone
+    slope = float(np.polyfit(processed, rss, 1)[0] * 1000) if len(samples) > 1 else 0.0
+    growth = float(rss[-1] - rss[0])
+    report = {
+        "model": args.model,
+        "heatmap_mode": args.heatmap_mode,
+        "images": int(processed[-1]),
+        "batch_size": args.batch_size,
+        "torch_num_threads": torch.get_num_threads(),
+        "seconds": round(elapsed, 1),
+        "baseline_rss_mb": float(rss[0]),
+        "final_rss_mb": float(rss[-1]),
+        "raw_rss_mb": {"baseline": float(raw_rss[0]), "final": float(raw_rss[-1]), "max": float(raw_rss.max())},
+        "rss_growth_mb": round(growth, 1),
+        "rss_slope_mb_per_1000_images": round(slope, 2),
+        "hooks": {"start": hooks_at_start, "end": count_hooks(heatmap.model)},
+        "samples": samples,
+    }
+    report["ok"] = growth <= args.max_growth_mb and report["hooks"]["start"] == report["hooks"]["end"]
+    heatmap.release()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ import authRoutes from "./routes/auth.js";
 import profileRoutes from "./routes/profile.js";
 import uploadRoutes from "./routes/upload.js";
 import historyRoutes from "./routes/history.js";
+import { getInferenceMetrics } from "./utils/yoloInference.js";
 import path from "path";
 import { fileURLToPath } from "url";
 
@@ -61,6 +62,10 @@ app.use("/uploads", express.static(path.join(__dirname, "uploads")));
 app.get("/api/test", (req, res) => {
   res.json({ message: "Server is up and running!" });
 });
+// Inference queue depth, wait and run times, for sizing the workers
+app.get("/api/inference/metrics", (req, res) => {
+  res.json(getInferenceMetrics());
+});
 
 // After all your routes
 app.use((err, req, res, next) => {
@@ -2,141 +2,633 @@
 import { spawn } from "child_process";
 import path from "path";
 import fs from "fs";
+import os from "os";
 import dotenv from "dotenv";
 
 // Load environment variables
 dotenv.config();
 
+const SCRIPT_PATH = "scripts/model_results.py";
+const MODEL_PATH = path.join(process.cwd(), "scripts", "best.pt");
+
+// Persistent worker settings. Set INFERENCE_WORKER=false to fall back to
+// spawning one Python process per X-ray.
+const USE_WORKER = process.env.INFERENCE_WORKER !== "false";
+const WORKER_CONCURRENCY = parseInt(process.env.INFERENCE_CONCURRENCY || "2", 10);
+// Detection runtime: torch, onnx or openvino (exported next to the model on first use)
+const INFERENCE_BACKEND = process.env.INFERENCE_BACKEND || "torch";
+// Detection precision: fp32, bf16 (torch) or int8 (onnx); reduced precisions
+// must have passed model_results.py --validate-precision for the model
+const INFERENCE_PRECISION = process.env.INFERENCE_PRECISION || "fp32";
+// Heatmap mode: full (EigenGradCAM), fast (gradient-free EigenCAM) or off
+const HEATMAP_MODE = process.env.HEATMAP_MODE || "full";
+// Optional normal/abnormal classifier (train_triage.py) run before detection;
+// studies it calls normal with at least TRIAGE_THRESHOLD probability skip the
+// detector, the heatmap and the explanation
+const TRIAGE_ARGS = process.env.TRIAGE_MODEL
+  ? ["--triage-model", process.env.TRIAGE_MODEL, "--triage-threshold", process.env.TRIAGE_THRESHOLD || "0.9"]
+  : [];
+// Optional second detector tier (e.g. a YOLOv8s best.pt): the model above
+// runs first and only studies with detections in the CASCADE_BAND confidence
+// band ("LOW HIGH") or with disagreeing classes are escalated to it
+const CASCADE_ARGS = process.env.CASCADE_MODEL
+  ? ["--cascade-model", process.env.CASCADE_MODEL, "--cascade-band", ...(process.env.CASCADE_BAND || "0.2 0.5").split(/\s+/)]
+  : [];
+
+// Pool settings. INFERENCE_WORKERS processes (or concurrent single-shot
+// runs) share the host; by default the cores are split evenly between them
+// and each one is pinned to its own block (Linux only, INFERENCE_PIN=false
+// to let the scheduler place them).
+const CPU_COUNT = os.cpus().length;
+const WORKER_COUNT = Math.max(1, parseInt(process.env.INFERENCE_WORKERS || "1", 10));
+const WORKER_THREADS = Math.max(
+  1,
+  parseInt(process.env.INFERENCE_THREADS || String(Math.floor(CPU_COUNT / WORKER_COUNT)), 10)
+);
+const PIN_WORKERS = process.env.INFERENCE_PIN !== "false" && process.platform === "linux";
+// Admission control: at most INFERENCE_QUEUE_SIZE jobs wait for a free worker
+// (more are rejected with a 503), and a job not answered within
+// INFERENCE_TIMEOUT_MS of arriving fails instead of holding the request open.
+const MAX_QUEUE = parseInt(process.env.INFERENCE_QUEUE_SIZE || "32", 10);
+const JOB_TIMEOUT_MS = parseInt(process.env.INFERENCE_TIMEOUT_MS || "120000", 10);
+
 /**
- * Runs YOLO inference on the provided X-ray image.
- * @param {string} xrayPath - Path to the uploaded X-ray image
- * @returns {Promise<object>} - Object containing paths to result images and analysis
+ * Builds the analysis object returned to the routes from the script's JSON.
+ * @param {object} paths - Result image paths
+ * @param {object|null} jsonResults - Parsed JSON results, if any
+ * @returns {object}
  */
-export const analyzeXray = async (xrayPath) => {
-  return new Promise(async (resolve, reject) => {
-    try {
-      // Create directories for storing the results if they don't exist
-      const resultDir = path.join("uploads", "results");
-      if (!fs.existsSync(resultDir)) {
-        fs.mkdirSync(resultDir, { recursive: true });
+const buildResult = (paths, jsonResults) => {
+  const heatmapExists = fs.existsSync(paths.heatmapResultPath);
+  return {
+    yoloResultPath: paths.yoloResultPath,
+    heatmapResultPath: heatmapExists ? paths.heatmapResultPath : null,
+    disease: jsonResults ? jsonResults.disease : "Other Diseases",
+    description: jsonResults
+      ? jsonResults.description
+      : "Analysis results are not available.",
+    disease_names: jsonResults ? jsonResults.disease_names : ["Unknown"],
+  };
+};
+
+/**
+ * Long-lived model_results.py process that loads the model once and takes
+ * jobs as JSON lines over stdin, answering with JSON lines on stdout.
+ * Detections come back first; when the explanation is still pending it
+ * arrives later as a separate "explanation" message for the same job id.
+ */
+export class InferenceWorker {
+  constructor(concurrency, placementArgs = []) {
+    this.concurrency = concurrency;
+    this.placementArgs = placementArgs;
+    this.placement = null;
+    this.process = null;
+    this.ready = null;
+    this.pending = new Map();
+    this.explanations = new Map();
+    this.nextId = 0;
+    this.buffer = "";
+    this.errorOutput = "";
+  }
+
+  spawnProcess() {
+    return spawn(
+      "python",
+      [
+        SCRIPT_PATH,
+        "--worker",
+        "--model",
+        MODEL_PATH,
+        "--concurrency",
+        String(this.concurrency),
+        "--backend",
+        INFERENCE_BACKEND,
+        "--precision",
+        INFERENCE_PRECISION,
+        "--heatmap-mode",
+        HEATMAP_MODE,
+        ...TRIAGE_ARGS,
+        ...CASCADE_ARGS,
+        "--async-explanation",
+        ...this.placementArgs,
+      ],
+      { env: { ...process.env } }
+    );
+  }
+
+  start() {
+    this.buffer = "";
+    this.errorOutput = "";
+    const child = this.spawnProcess();
+    this.process = child;
+
+    this.ready = new Promise((resolve, reject) => {
+      this.onReady = resolve;
+      this.onStartFailed = reject;
+    });
+
+    child.stdout.on("data", (data) => {
+      // Output of a killed process is no longer ours
+      if (this.process !== child) {
+        return;
       }
+      this.buffer += data.toString();
+      let newline;
+      while ((newline = this.buffer.indexOf("\n")) !== -1) {
+        const line = this.buffer.slice(0, newline).trim();
+        this.buffer = this.buffer.slice(newline + 1);
+        if (line) {
+          this.handleMessage(line);
+        }
+      }
+    });
 
-      // Generate unique filenames for result images and JSON
-      const timestamp = Date.now();
-      const yoloResultPath = path.join(
-        resultDir,
-        `yolo_result_${timestamp}.png`
-      );
-      const heatmapResultPath = path.join(
-        resultDir,
-        `heatmap_result_${timestamp}.png`
-      );
-      const jsonOutputPath = path.join(resultDir, `analysis_${timestamp}.json`);
-
-      // Set up environment for the Python process
-      const env = { ...process.env };
-
-      console.log("Running YOLO inference on:", xrayPath);
-
-      // Run Python script for inference
-      const pythonProcess = spawn(
-        "python",
-        [
-          "scripts/model_results.py", // Using the new script
-          "--input",
-          xrayPath,
-          "--yolo-output",
-          yoloResultPath,
-          "--heatmap-output",
-          heatmapResultPath,
-          "--model",
-          path.join(process.cwd(), "scripts", "best.pt"),
-          "--output-json",
-          jsonOutputPath,
-        ],
-        { env: env }
+    // Keep the tail of stderr for error reporting
+    child.stderr.on("data", (data) => {
+      if (this.process === child) {
+        this.errorOutput = (this.errorOutput + data.toString()).slice(-4000);
+      }
+    });
+
+    child.on("close", (code) => {
+      // A killed worker has already failed its jobs
+      if (this.process !== child) {
+        return;
+      }
+      console.error("Inference worker exited with code:", code);
+      this.fail(
+        new Error(`Inference worker exited with code ${code}: ${this.errorOutput}`)
       );
+    });
 
-      // Capture stdout for direct JSON results
-      let stdoutData = "";
-      pythonProcess.stdout.on("data", (data) => {
-        stdoutData += data.toString();
-      });
+    console.log("Inference worker started.");
+  }
+
+  /**
+   * Fails every job and explanation still waiting on the process and forgets
+   * it; the next job starts a new one.
+   * @param {Error} error - What they fail with
+   */
+  fail(error) {
+    this.onStartFailed(error);
+    for (const { reject } of this.pending.values()) {
+      reject(error);
+    }
+    for (const { reject } of this.explanations.values()) {
+      reject(error);
+    }
+    this.pending.clear();
+    this.explanations.clear();
+    this.process = null;
+  }
+
+  /**
+   * Kills a worker stuck on a job. Its deadline check only runs before a job
+   * starts, so a job that hangs once running would hold its slot forever.
+   * @param {Error} error - What the jobs still on the worker fail with
+   */
+  kill(error) {
+    const child = this.process;
+    if (!child) {
+      return;
+    }
+    console.error("Killing inference worker:", error.message);
+    this.fail(error);
+    child.kill("SIGKILL");
+  }
+
+  handleMessage(line) {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (e) {
+      console.error("Unexpected inference worker output:", line);
+      return;
+    }
 
-      // Handle Python script errors
-      let errorOutput = "";
-      pythonProcess.stderr.on("data", (data) => {
-        errorOutput += data.toString();
+    if (message.type === "ready") {
+      // pid, threads and pinned cpus as the worker sees them
+      const { type, ...placement } = message;
+      this.placement = placement;
+      this.onReady();
+      return;
+    }
+
+    if (message.type === "explanation") {
+      const explanation = this.explanations.get(message.id);
+      if (!explanation) {
+        return;
+      }
+      this.explanations.delete(message.id);
+      if (message.ok) {
+        explanation.resolve(message.result);
+      } else {
+        explanation.reject(new Error(`Explanation failed: ${message.error}`));
+      }
+      return;
+    }
+
+    const job = this.pending.get(message.id);
+    if (!job) {
+      return;
+    }
+    this.pending.delete(message.id);
+    if (!message.ok) {
+      job.reject(new Error(`YOLO inference failed: ${message.error}`));
+      return;
+    }
+
+    let explanation = Promise.resolve(message.result);
+    if (message.result.explanation_pending) {
+      explanation = new Promise((resolve, reject) => {
+        this.explanations.set(message.id, { resolve, reject });
       });
+    }
+    job.resolve({ result: message.result, explanation });
+  }
 
-      console.log("Python process started.");
+  /**
+   * Sends a job to the worker.
+   * @param {object} job - Input and output paths
+   * @returns {Promise<{result: object, explanation: Promise<object>}>} - The
+   * detection result and a promise for the result with the explanation
+   */
+  async run(job) {
+    if (!this.process) {
+      this.start();
+    }
+    await this.ready;
 
-      pythonProcess.on("close", (code) => {
-        if (code !== 0) {
-          console.error("Python process exited with code:", code);
-          console.error("Python process error:", errorOutput);
-          return reject(
-            new Error(`YOLO inference failed with code ${code}: ${errorOutput}`)
-          );
-        }
+    const id = String(this.nextId++);
+    return new Promise((resolve, reject) => {
+      this.pending.set(id, { resolve, reject });
+      this.process.stdin.write(JSON.stringify({ id, ...job }) + "\n");
+    });
+  }
+}
+
+/**
+ * Keeps the last samples of a measurement for percentiles.
+ */
+class RollingStats {
+  constructor(size = 1000) {
+    this.size = size;
+    this.values = [];
+    this.count = 0;
+  }
+
+  add(value) {
+    this.values[this.count++ % this.size] = value;
+  }
+
+  summary() {
+    const sorted = [...this.values].sort((a, b) => a - b);
+    const percentile = (p) =>
+      sorted.length ? sorted[Math.min(sorted.length - 1, Math.floor(p * sorted.length))] : 0;
+    return {
+      count: this.count,
+      p50: percentile(0.5),
+      p95: percentile(0.95),
+      max: sorted.length ? sorted[sorted.length - 1] : 0,
+    };
+  }
+}
+
+/**
+ * Bounded FIFO queue in front of a fixed set of slots (worker processes, or
+ * single-shot runs). A job is started on the least busy slot with room for
+ * it, is rejected right away when the queue is full and fails once its
+ * deadline passes, whether it is still waiting or already running. A
+ * worker still running a job past its deadline is killed to free the slot.
+ */
+export class InferencePool {
+  constructor(slots, maxQueue, timeoutMs) {
+    this.slots = slots;
+    this.maxQueue = maxQueue;
+    this.timeoutMs = timeoutMs;
+    this.queue = [];
+    this.counters = { submitted: 0, completed: 0, failed: 0, rejected: 0, timedOut: 0, workersKilled: 0 };
+    this.waitMs = new RollingStats();
+    this.runMs = new RollingStats();
+  }
+
+  /**
+   * Queues a job.
+   * @param {function(object, number): Promise} task - Runs the job on a slot
+   * before the deadline (epoch milliseconds)
+   * @returns {Promise} - What the task resolves with
+   */
+  run(task) {
+    if (this.queue.length >= this.maxQueue) {
+      this.counters.rejected++;
+      const error = new Error(
+        `Inference queue is full (${this.queue.length} jobs waiting), try again later`
+      );
+      error.code = "QUEUE_FULL";
+      error.statusCode = 503;
+      return Promise.reject(error);
+    }
+
+    this.counters.submitted++;
+    return new Promise((resolve, reject) => {
+      const enqueuedAt = Date.now();
+      const entry = { task, resolve, reject, enqueuedAt, deadline: enqueuedAt + this.timeoutMs };
+      entry.timer = setTimeout(() => this.expire(entry), this.timeoutMs);
+      this.queue.push(entry);
+      this.dispatch();
+    });
+  }
+
+  expire(entry) {
+    if (entry.settled) {
+      return;
+    }
+    const index = this.queue.indexOf(entry);
+    if (index !== -1) {
+      this.queue.splice(index, 1);
+    }
+    this.counters.timedOut++;
+    const error = new Error(
+      `Inference timed out after ${this.timeoutMs} ms (${index !== -1 ? "still queued" : "running"})`
+    );
+    error.code = "TIMEOUT";
+    error.statusCode = 504;
+    this.settle(entry, error);
+
+    // A running job only gives its slot back when the worker answers, so
+    // kill a worker that is past the deadline; its jobs fail and the next
+    // job on the slot starts a new one
+    if (index === -1 && entry.slot.worker) {
+      this.counters.workersKilled++;
+      entry.slot.worker.kill(
+        new Error(`Inference worker killed: a job ran past its ${this.timeoutMs} ms deadline`)
+      );
+    }
+  }
+
+  settle(entry, error, value) {
+    if (entry.settled) {
+      return;
+    }
+    entry.settled = true;
+    clearTimeout(entry.timer);
+    if (error) {
+      entry.reject(error);
+    } else {
+      entry.resolve(value);
+    }
+  }
 
-        // Check if YOLO result file exists (minimum requirement)
-        if (!fs.existsSync(yoloResultPath)) {
-          return reject(new Error("YOLO result file was not generated."));
+  dispatch() {
+    while (this.queue.length) {
+      let slot = null;
+      for (const candidate of this.slots) {
+        if (candidate.running < candidate.capacity && (!slot || candidate.running < slot.running)) {
+          slot = candidate;
         }
+      }
+      if (!slot) {
+        return;
+      }
+
+      const entry = this.queue.shift();
+      const startedAt = Date.now();
+      this.waitMs.add(startedAt - entry.enqueuedAt);
+      entry.slot = slot;
+      slot.running++;
+      Promise.resolve()
+        .then(() => entry.task(slot, entry.deadline))
+        .then(
+          (value) => {
+            // A timed out job was counted already
+            if (!entry.settled) {
+              this.counters.completed++;
+              this.runMs.add(Date.now() - startedAt);
+            }
+            this.settle(entry, null, value);
+          },
+          (error) => {
+            if (!entry.settled) {
+              this.counters.failed++;
+            }
+            this.settle(entry, error);
+          }
+        )
+        // A job keeps its slot until its process answers, exits or is killed
+        .finally(() => {
+          slot.running--;
+          this.dispatch();
+        });
+    }
+  }
+
+  metrics() {
+    return {
+      ...this.counters,
+      queueDepth: this.queue.length,
+      maxQueue: this.maxQueue,
+      running: this.slots.reduce((total, slot) => total + slot.running, 0),
+      waitMs: this.waitMs.summary(),
+      runMs: this.runMs.summary(),
+      slots: this.slots.map((slot) => ({
+        running: slot.running,
+        capacity: slot.capacity,
+        threads: slot.threads,
+        cpus: slot.cpus,
+        ...(slot.worker && slot.worker.placement ? { pid: slot.worker.placement.pid } : {}),
+      })),
+    };
+  }
+}
+
+/**
+ * Builds the pool slots: a block of WORKER_THREADS cores per slot, wrapping
+ * around when there are more slots than cores.
+ * @returns {Array<object>}
+ */
+const createSlots = () => {
+  return Array.from({ length: WORKER_COUNT }, (_, index) => {
+    const cpus = PIN_WORKERS
+      ? Array.from({ length: Math.min(WORKER_THREADS, CPU_COUNT) }, (_, i) => (index * WORKER_THREADS + i) % CPU_COUNT)
+      : null;
+    const args = ["--threads", String(WORKER_THREADS)];
+    if (cpus) {
+      args.push("--cpus", cpus.join(","));
+    }
+    return {
+      args,
+      cpus,
+      threads: WORKER_THREADS,
+      running: 0,
+      capacity: USE_WORKER ? WORKER_CONCURRENCY : 1,
+      worker: USE_WORKER ? new InferenceWorker(WORKER_CONCURRENCY, args) : null,
+    };
+  });
+};
+
+const pool = new InferencePool(createSlots(), MAX_QUEUE, JOB_TIMEOUT_MS);
+
+/**
+ * Queue depth, wait and run times of the inference pool, for sizing nodes.
+ * @returns {object}
+ */
+export const getInferenceMetrics = () => pool.metrics();
+
+/**
+ * Runs YOLO inference in a new Python process for a single X-ray.
+ * @param {string} xrayPath - Path to the uploaded X-ray image
+ * @param {object} paths - Result image and JSON paths
+ * @param {object} slot - Pool slot the process runs in
+ * @param {number} deadline - Epoch milliseconds after which the process is killed
+ * @returns {Promise<object>}
+ */
+const analyzeXraySingleShot = (xrayPath, paths, slot, deadline) => {
+  return new Promise((resolve, reject) => {
+    // Set up environment for the Python process
+    const env = { ...process.env };
+
+    // Run Python script for inference
+    const pythonProcess = spawn(
+      "python",
+      [
+        SCRIPT_PATH,
+        "--input",
+        xrayPath,
+        "--yolo-output",
+        paths.yoloResultPath,
+        "--heatmap-output",
+        paths.heatmapResultPath,
+        "--model",
+        MODEL_PATH,
+        "--output-json",
+        paths.jsonOutputPath,
+        "--backend",
+        INFERENCE_BACKEND,
+        "--precision",
+        INFERENCE_PRECISION,
+        "--heatmap-mode",
+        HEATMAP_MODE,
+        ...TRIAGE_ARGS,
+        ...CASCADE_ARGS,
+        ...slot.args,
+      ],
+      { env: env, timeout: Math.max(1, deadline - Date.now()) }
+    );
+
+    // Capture stdout for direct JSON results
+    let stdoutData = "";
+    pythonProcess.stdout.on("data", (data) => {
+      stdoutData += data.toString();
+    });
+
+    // Handle Python script errors
+    let errorOutput = "";
+    pythonProcess.stderr.on("data", (data) => {
+      errorOutput += data.toString();
+    });
 
-        // Heatmap might be missing if generation failed but YOLO succeeded
-        const heatmapExists = fs.existsSync(heatmapResultPath);
+    console.log("Python process started.");
+
+    pythonProcess.on("close", (code) => {
+      if (code !== 0) {
+        console.error("Python process exited with code:", code);
+        console.error("Python process error:", errorOutput);
+        return reject(
+          new Error(`YOLO inference failed with code ${code}: ${errorOutput}`)
+        );
+      }
+
+      // Check if YOLO result file exists (minimum requirement)
+      if (!fs.existsSync(paths.yoloResultPath)) {
+        return reject(new Error("YOLO result file was not generated."));
+      }
 
-        // Try to parse the JSON results first from stdout
+      // Try to parse the JSON results first from stdout
+      try {
+        resolve(buildResult(paths, JSON.parse(stdoutData)));
+      } catch (e) {
+        // If stdout parsing fails, try to read the JSON file
         try {
-          const jsonResults = JSON.parse(stdoutData);
+          if (fs.existsSync(paths.jsonOutputPath)) {
+            const jsonData = JSON.parse(
+              fs.readFileSync(paths.jsonOutputPath, "utf8")
+            );
+            resolve(buildResult(paths, jsonData));
+          } else {
+            // Fallback to default values if JSON data is not available
+            resolve(buildResult(paths, null));
+          }
+        } catch (jsonError) {
+          // Last resort fallback
+          console.error("Error parsing JSON results:", jsonError);
           resolve({
-            yoloResultPath,
-            heatmapResultPath: heatmapExists ? heatmapResultPath : null,
-            disease: jsonResults.disease,
-            description: jsonResults.description,
-            disease_names: jsonResults.disease_names,
+            ...buildResult(paths, null),
+            description: "Could not parse analysis results.",
           });
-        } catch (e) {
-          // If stdout parsing fails, try to read the JSON file
-          try {
-            if (fs.existsSync(jsonOutputPath)) {
-              const jsonData = JSON.parse(
-                fs.readFileSync(jsonOutputPath, "utf8")
-              );
-              resolve({
-                yoloResultPath,
-                heatmapResultPath: heatmapExists ? heatmapResultPath : null,
-                disease: jsonData.disease,
-                description: jsonData.description,
-                disease_names: jsonData.disease_names,
-              });
-            } else {
-              // Fallback to default values if JSON data is not available
-              resolve({
-                yoloResultPath,
-                heatmapResultPath: heatmapExists ? heatmapResultPath : null,
-                disease: "Other Diseases",
-                description: "Analysis results are not available.",
-                disease_names: ["Unknown"],
-              });
-            }
-          } catch (jsonError) {
-            // Last resort fallback
-            console.error("Error parsing JSON results:", jsonError);
-            resolve({
-              yoloResultPath,
-              heatmapResultPath: heatmapExists ? heatmapResultPath : null,
-              disease: "Other Diseases",
-              description: "Could not parse analysis results.",
-              disease_names: ["Unknown"],
-            });
-          }
         }
-      });
-    } catch (error) {
-      reject(error);
-    }
+      }
+    });
   });
 };
+
+/**
+ * Runs YOLO inference on the provided X-ray image. With the worker, the
+ * analysis resolves as soon as the detections and images are ready; when the
+ * explanation is still pending, the analysis carries explanationPending and
+ * an explanation promise for the final analysis, which never rejects (a
+ * failed explanation becomes the description, as in the script).
+ * @param {string} xrayPath - Path to the uploaded X-ray image
+ * @returns {Promise<object>} - Object containing paths to result images and analysis
+ */
+export const analyzeXray = async (xrayPath) => {
+  // Create directories for storing the results if they don't exist
+  const resultDir = path.join("uploads", "results");
+  if (!fs.existsSync(resultDir)) {
+    fs.mkdirSync(resultDir, { recursive: true });
+  }
+
+  // Generate unique filenames for result images and JSON
+  const timestamp = Date.now();
+  const paths = {
+    yoloResultPath: path.join(resultDir, `yolo_result_${timestamp}.png`),
+    heatmapResultPath: path.join(resultDir, `heatmap_result_${timestamp}.png`),
+    jsonOutputPath: path.join(resultDir, `analysis_${timestamp}.json`),
+  };
+
+  console.log("Running YOLO inference on:", xrayPath);
+
+  if (!USE_WORKER) {
+    return pool.run((slot, deadline) => analyzeXraySingleShot(xrayPath, paths, slot, deadline));
+  }
+
+  const { result, explanation } = await pool.run((slot, deadline) =>
+    slot.worker.run({
+      input: xrayPath,
+      yolo_output: paths.yoloResultPath,
+      heatmap_output: paths.heatmapResultPath,
+      output_json: paths.jsonOutputPath,
+      deadline,
+    })
+  );
+
+  // Check if YOLO result file exists (minimum requirement)
+  if (!fs.existsSync(paths.yoloResultPath)) {
+    throw new Error("YOLO result file was not generated.");
+  }
+
+  const analysis = buildResult(paths, result);
+  if (!result.explanation_pending) {
+    return analysis;
+  }
+
+  // Detections and images are ready here; the explanation follows without
+  // holding the request (the script bounds it with --llm-timeout)
+  return {
+    ...analysis,
+    explanationPending: true,
+    explanation: explanation.then(
+      (finalResults) => buildResult(paths, finalResults),
+      (error) => ({ ...analysis, description: `Error getting explanation: ${error.message}` })
+    ),
+  };
+};
@@ -179,6 +179,8 @@ type AnalysisResult = {
   disease: string;
   description: string;
   disease_names: string[];
+  xrayId?: string;
+  explanationPending?: boolean;
 };
 
 const ImageViewer = ({
@@ -490,6 +492,49 @@ export default function Upload() {
     };
   }, [xrayFile]);
 
+  useEffect(() => {
+    // The explanation is written after the detections come back; poll the
+    // saved result until it is in
+    if (!analysisResult?.explanationPending || !selectedPatient) {
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const response = await fetch(
+          `${process.env.REACT_APP_API_BASE_URL}/api/upload/xray-result/${selectedPatient._id}/${analysisResult.xrayId}`,
+          {
+            method: "GET",
+            headers: {
+              Authorization: `${localStorage.getItem("token")}`,
+            },
+          }
+        );
+        if (response.status === 404) {
+          // The X-ray is gone; stop polling
+          setAnalysisResult((current) =>
+            current ? { ...current, explanationPending: false } : current
+          );
+          return;
+        }
+        if (!response.ok) {
+          throw new Error("Failed to load the explanation");
+        }
+        const data = await response.json();
+        setAnalysisResult((current) =>
+          current && current.xrayId === data.result.xrayId
+            ? { ...current, ...data.result }
+            : current
+        );
+      } catch (error) {
+        console.error("Error fetching explanation:", error);
+        // Try again on the next tick
+        setAnalysisResult((current) => (current ? { ...current } : current));
+      }
+    }, 2000);
+
+    return () => clearTimeout(timer);
+  }, [analysisResult, selectedPatient]);
+
   const fetchPatientList = async () => {
     setIsPatientListLoading(true);
     try {
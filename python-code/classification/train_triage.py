@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+import pandas as pd
+from ultralytics import YOLO
+
+# Trains the triage classifier of backend/scripts/model_results.py (--triage-model):
+# a small YOLOv8 image classifier telling normal studies (every radiologist
+# marked "No finding" in image_labels_train.csv) from the rest, on the resized
+# PNGs from preprocess_dataset.py. The classifiers of classification_models.ipynb
+# predict the global labels from the lesion labels, so they cannot look at an
+# image; this one uses the same labels as its target. After training, the
+# normal-class threshold is swept on the validation split and the one with the
+# highest skip rate that misses at most --max-miss-rate of the abnormal studies
+# is recommended. Inputs are the aspect-preserving, zero-padded squares of
+# preprocess_dataset.py shrunk to --imgsz, here and in triage_batch, so the
+# threshold is calibrated on what it gates at runtime.
+#
+#   python train_triage.py --images resized_train_images --labels image_labels_train.csv \
+#       --output-dir triage --epochs 30
+#   python model_results.py ... --triage-model triage/train/weights/best.pt --triage-threshold <threshold>
+
+CLASS_NAMES = ("abnormal", "normal")
+
+# -------------------- Dataset --------------------
+
+# Function to label each image normal (1) or abnormal (0) from the radiologists' labels
+def normal_labels(labels):
+    """An image is normal only when every row for it (one per radiologist) is "No finding" """
+    return labels.groupby("image_id")["No finding"].min().eq(1).astype(int)
+
+# Function to lay the images out as an ImageFolder dataset (split/class/image) with symlinks
+def build_dataset(images_dir, labels, dataset_dir, val_fraction=0.2, seed=0):
+    normal = normal_labels(labels)
+    paths = {image_id: os.path.join(images_dir, f"{image_id}.png") for image_id in normal.index}
+    normal = normal[[os.path.isfile(path) for path in paths.values()]]
+    if normal.empty:
+        raise FileNotFoundError(f"None of the labelled images were found in {images_dir}")
+
+    # Stratified split, so the validation split has the same share of normal studies
+    rng = np.random.default_rng(seed)
+    val = set()
+    for _, group in normal.groupby(normal):
+        ids = group.index.to_numpy()
+        val.update(rng.choice(ids, int(round(len(ids) * val_fraction)), replace=False))
+
+    counts = {}
+    for image_id, is_normal in normal.items():
+        split = "val" if image_id in val else "train"
+        class_dir = os.path.join(dataset_dir, split, CLASS_NAMES[is_normal])
+        os.makedirs(class_dir, exist_ok=True)
+        link = os.path.join(class_dir, f"{image_id}.png")
+        if not os.path.lexists(link):
+            os.symlink(os.path.abspath(paths[image_id]), link)
+        counts[f"{split}_{CLASS_NAMES[is_normal]}"] = counts.get(f"{split}_{CLASS_NAMES[is_normal]}", 0) + 1
+    return counts
+
+# -------------------- Threshold Sweep --------------------
+
+# Function to get the normal-class probability of every validation image
+def normal_probabilities(weights, val_dir, imgsz, batch_size=32):
+    """
+    Same input as model_results.triage_batch: the letterboxed, zero-padded
+    PNG from preprocess_dataset.py shrunk to imgsz with INTER_AREA
+    """
+    classifier = YOLO(weights)
+    normal_index = {name: index for index, name in classifier.names.items()}["normal"]
+    probabilities, is_normal = [], []
+    for label, class_name in enumerate(CLASS_NAMES):
+        class_dir = os.path.join(val_dir, class_name)
+        paths = sorted(os.path.join(class_dir, name) for name in os.listdir(class_dir))
+        for start in range(0, len(paths), batch_size):
+            images = [
+                cv2.resize(cv2.imread(path), (imgsz, imgsz), interpolation=cv2.INTER_AREA)
+                for path in paths[start:start + batch_size]
+            ]
+            for prediction in classifier.predict(images, imgsz=imgsz, verbose=False):
+                probabilities.append(float(prediction.probs.data[normal_index]))
+                is_normal.append(label)
+    return np.array(probabilities), np.array(is_normal, dtype=bool)
+
+# Function to compute the skip rate and the missed abnormal studies at each threshold
+def sweep_thresholds(probabilities, is_normal, thresholds):
+    rows = []
+    for threshold in thresholds:
+        skipped = probabilities >= threshold
+        rows.append({
+            "threshold": round(float(threshold), 3),
+            # Share of all studies that would skip the detector
+            "skip_rate": round(float(skipped.mean()), 4),
+            # Share of the abnormal studies that would skip it too
+            "miss_rate": round(float(skipped[~is_normal].mean()), 4) if (~is_normal).any() else 0.0,
+            # Share of the normal studies caught
+            "normal_recall": round(float(skipped[is_normal].mean()), 4) if is_normal.any() else 0.0,
+        })
+    return rows
+
+# -------------------- CLI --------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Train the normal/abnormal triage classifier and pick its threshold')
+    parser.add_argument('--images', type=str, required=True, help='Directory of the resized PNGs (<image_id>.png)')
+    parser.add_argument('--labels', type=str, required=True, help='image_labels_train.csv')
+    parser.add_argument('--output-dir', type=str, default='triage', help='Directory for the dataset, the training run and the report')
+    parser.add_argument('--model', type=str, default='yolov8n-cls.pt', help='Classifier to start from (a .pt checkpoint or a .yaml to train from scratch)')
+    parser.add_argument('--weights', type=str, default='', help='Skip training and only sweep the thresholds of these weights')
+    parser.add_argument('--imgsz', type=int, default=224, help='Classifier input size')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=4, help='Dataloader workers')
+    parser.add_argument('--val-fraction', type=float, default=0.2, help='Share of the images held out for the threshold sweep')
+    parser.add_argument('--max-miss-rate', type=float, default=0.01, help='Largest share of abnormal studies the recommended threshold may skip')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    dataset_dir = os.path.join(args.output_dir, "dataset")
+    report = {"dataset": build_dataset(args.images, pd.read_csv(args.labels), dataset_dir, args.val_fraction, args.seed)}
+
+    weights = args.weights
+    if not weights:
+        model = YOLO(args.model)
+        model.train(
+            data=os.path.abspath(dataset_dir), imgsz=args.imgsz, epochs=args.epochs, batch=args.batch,
+            workers=args.workers, seed=args.seed, project=os.path.abspath(args.output_dir), name="train",
+            exist_ok=True, plots=False)
+        weights = str(model.trainer.best)
+    report["weights"] = weights
+
+    probabilities, is_normal = normal_probabilities(weights, os.path.join(dataset_dir, "val"), args.imgsz)
+    sweep = sweep_thresholds(probabilities, is_normal, np.arange(0.5, 1.0, 0.01))
+    # The lowest threshold that stays within the miss budget skips the most studies
+    passing = [row for row in sweep if row["miss_rate"] <= args.max_miss_rate]
+    report["max_miss_rate"] = args.max_miss_rate
+    report["recommended"] = passing[0] if passing else None
+    report["sweep"] = sweep
+
+    print(json.dumps({k: v for k, v in report.items() if k != "sweep"}, indent=2))
+    with open(os.path.join(args.output_dir, "triage_report.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+    return 0 if passing else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import box_fusion
+
+try:
+    from ensemble_boxes import weighted_boxes_fusion as ensemble_wbf
+except ImportError:  # only needed to cross-check the WBF rule
+    ensemble_wbf = None
+
+# Benchmark of box_fusion against the notebook's fusion on an annotation CSV
+# (annotations_train.csv from VinDr-CXR, or a synthetic table of the same shape).
+#
+#   python benchmark_box_fusion.py --annotations annotations_train.csv
+
+# -------------------- Notebook Implementation --------------------
+# iou / weighted_fuse / grouping_annotations as in process_images.ipynb
+
+def iou(box1, box2):
+    x1 = max(box1[0], box2[0])
+    y1 = max(box1[1], box2[1])
+    x2 = min(box1[2], box2[2])
+    y2 = min(box1[3], box2[3])
+
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+    area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    union = area1 + area2 - intersection
+
+    return intersection / union if union > 0 else 0
+
+def weighted_fuse(boxes, iou_threshold=0.5):
+    fused_boxes = []
+
+    while boxes:
+        base_box = boxes.pop(0)
+        to_merge = [base_box]
+
+        # Find all boxes that overlap with the base_box
+        for box in boxes[:]:
+            if iou(base_box, box) >= iou_threshold:
+                to_merge.append(box)
+                boxes.remove(box)
+
+        # If there are overlapping boxes, retain only the largest one
+        if len(to_merge) > 1:
+            largest_box = max(to_merge, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]))  # Area calculation
+            fused_boxes.append(largest_box)
+        else:
+            # If no significant overlaps, just add the single box
+            fused_boxes.append(to_merge[0])
+
+    return fused_boxes
+
+def grouping_annotations(df, iou_threshold=0.5):
+    # Drop rows where there are no bounding boxes (e.g., 'No finding')
+    df = df.dropna(subset=['x_min', 'y_min', 'x_max', 'y_max'])
+
+    # Group data by image_id and class_name
+    grouped = df.groupby(['image_id', 'class_name'])
+    fused_results = []
+
+    for (image_id, class_name), group in grouped:
+
+        boxes = group[['x_min', 'y_min', 'x_max', 'y_max']].values.tolist()
+        fused_boxes = weighted_fuse(boxes, iou_threshold=iou_threshold)
+
+        for box in fused_boxes:
+            fused_results.append({
+                "image_id": image_id,
+                "class_name": class_name,
+                "x_min": box[0],
+                "y_min": box[1],
+                "x_max": box[2],
+                "y_max": box[3],
+            })
+
+    return pd.DataFrame(fused_results)
+
+# -------------------- Inputs --------------------
+
+CLASS_NAMES = [
+    "Aortic enlargement", "Atelectasis", "Calcification", "Cardiomegaly", "Consolidation",
+    "ILD", "Infiltration", "Lung Opacity", "Nodule/Mass", "Other lesion", "Pleural effusion",
+    "Pleural thickening", "Pneumothorax", "Pulmonary fibrosis",
+]
+
+# Function to build a table shaped like annotations_train.csv
+def synthetic_annotations(num_images, seed=0):
+    """
+    Three radiologists per image; about 70% of the images are "No finding" for
+    all of them, the others get a few findings each radiologist boxes with jitter
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(num_images):
+        image_id = f"{rng.integers(1 << 62):016x}"
+        rad_ids = rng.choice([f"R{r}" for r in range(1, 18)], 3, replace=False)
+        if rng.random() < 0.7:
+            rows += [(image_id, "No finding", rad_id, np.nan, np.nan, np.nan, np.nan) for rad_id in rad_ids]
+            continue
+        for _ in range(rng.integers(1, 5)):
+            class_name = CLASS_NAMES[rng.integers(len(CLASS_NAMES))]
+            x, y = rng.uniform(200, 2000, 2)
+            w, h = rng.uniform(50, 800, 2)
+            for rad_id in rad_ids[:rng.integers(1, 4)]:
+                jitter = rng.normal(0, 0.08, 4) * [w, h, w, h]
+                box = np.array([x, y, x + w, y + h]) + jitter
+                rows.append((image_id, class_name, rad_id, *np.round(box, 1)))
+    return pd.DataFrame(rows, columns=["image_id", "class_name", "rad_id"] + box_fusion.BOX_COLUMNS)
+
+# -------------------- Benchmark --------------------
+
+def timed_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, round((time.perf_counter() - start) * 1000, 2)
+
+# Function to check box_fusion's WBF against ensemble_boxes on every multi-box group
+def check_wbf(df, iou_threshold):
+    df = df.dropna(subset=box_fusion.BOX_COLUMNS)
+    max_diff = 0.0
+    for _, group in df.groupby(["image_id", "class_name"]):
+        if len(group) < 2:
+            continue
+        boxes = group[box_fusion.BOX_COLUMNS].to_numpy(dtype=np.float64)
+        # ensemble_boxes works on normalized coordinates
+        scale = boxes.max()
+        expected, _, _ = ensemble_wbf([boxes / scale], [np.ones(len(boxes))], [np.zeros(len(boxes))], iou_thr=iou_threshold)
+        _, fused = box_fusion.weighted_boxes_fusion(boxes, iou_threshold)
+        if len(expected) != len(fused):
+            return None
+        max_diff = max(max_diff, float(np.abs(np.sort(expected * scale, axis=0) - np.sort(fused, axis=0)).max()))
+    return max_diff
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark box_fusion against the notebook fusion')
+    parser.add_argument('--annotations', type=str, default='', help='annotations_train.csv (default: a synthetic table)')
+    parser.add_argument('--num-images', type=int, default=15000, help='Images in the synthetic table')
+    parser.add_argument('--iou-threshold', type=float, default=0.5)
+    parser.add_argument('--output', type=str, default='', help='Path to save the JSON report')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    df = pd.read_csv(args.annotations) if args.annotations else synthetic_annotations(args.num_images)
+
+    notebook, notebook_ms = timed_call(grouping_annotations, df, iou_threshold=args.iou_threshold)
+    largest, largest_ms = timed_call(box_fusion.fuse_annotations, df, iou_threshold=args.iou_threshold)
+    wbf, wbf_ms = timed_call(box_fusion.fuse_annotations, df, iou_threshold=args.iou_threshold, method="wbf")
+
+    report = {
+        "rows": len(df),
+        "boxes": int(df[box_fusion.BOX_COLUMNS].notna().all(axis=1).sum()),
+        "notebook_ms": notebook_ms,
+        "largest_ms": largest_ms,
+        "wbf_ms": wbf_ms,
+        "speedup": round(notebook_ms / max(largest_ms, 1e-6), 1),
+        "fused_boxes": {"notebook": len(notebook), "largest": len(largest), "wbf": len(wbf)},
+        # The "largest" rule must reproduce the notebook exactly
+        "identical": bool(notebook.equals(largest[notebook.columns])) if len(notebook) else len(largest) == 0,
+    }
+    if ensemble_wbf is not None:
+        report["wbf_max_diff_vs_ensemble_boxes"] = check_wbf(df, args.iou_threshold)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
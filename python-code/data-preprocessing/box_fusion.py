@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+# Fusion of the radiologists' boxes from process_images.ipynb, without the
+# per-pair Python loops. Boxes are grouped by image and class in one sort and
+# the IoUs of every pair inside every group are computed in one NumPy pass;
+# only groups with partly overlapping boxes are then walked box by box.
+#
+#   from box_fusion import process_annotations
+#   processed = process_annotations(pd.read_csv("annotations_train.csv"))
+
+BOX_COLUMNS = ["x_min", "y_min", "x_max", "y_max"]
+
+# -------------------- IoU --------------------
+
+# Function to compute the IoU of matching rows of two box arrays (broadcasting) -> [...]
+def pairwise_iou(boxes1, boxes2):
+    """Same values as the notebook's iou(): 0 where the union is empty"""
+    x1 = np.maximum(boxes1[..., 0], boxes2[..., 0])
+    y1 = np.maximum(boxes1[..., 1], boxes2[..., 1])
+    x2 = np.minimum(boxes1[..., 2], boxes2[..., 2])
+    y2 = np.minimum(boxes1[..., 3], boxes2[..., 3])
+
+    intersection = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+    union = area1 + area2 - intersection
+
+    return np.where(union > 0, intersection / np.where(union > 0, union, 1), 0.0)
+
+# Function to compute the IoU of every pair of boxes [N, 4] x [M, 4] -> [N, M]
+def iou_matrix(boxes1, boxes2=None):
+    boxes2 = boxes1 if boxes2 is None else boxes2
+    return pairwise_iou(boxes1[:, None], boxes2[None, :])
+
+# Function to compute the IoU matrices of all groups of contiguous boxes at once
+def grouped_iou(boxes, starts, sizes):
+    """Flat array holding the row-major n x n IoU matrix of each group in turn"""
+    # Row i of the table pairs with every box of its group
+    row_sizes = np.repeat(sizes, sizes)
+    rows = np.repeat(np.arange(len(boxes)), row_sizes)
+    # Position of each pair inside its row, plus the group start
+    row_offsets = np.cumsum(row_sizes) - row_sizes
+    columns = np.arange(len(rows)) - np.repeat(row_offsets, row_sizes) + np.repeat(np.repeat(starts, sizes), row_sizes)
+    return pairwise_iou(boxes[rows], boxes[columns])
+
+# -------------------- Fusion Rules --------------------
+
+# Function to fuse the boxes of one image and class by keeping the largest box of each cluster
+def keep_largest(boxes, iou_threshold=0.5, scores=None, iou=None):
+    """
+    The weighted_fuse rule: take the first remaining box, cluster it with every
+    remaining box whose IoU with it reaches the threshold and keep the largest
+    box of the cluster. Returns the indices of the kept boxes and the boxes.
+    """
+    iou = (iou_matrix(boxes) if iou is None else iou) >= iou_threshold
+    # The base box is always part of its own cluster, even when it has no area
+    np.fill_diagonal(iou, True)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    remaining = np.ones(len(boxes), dtype=bool)
+    kept = []
+    for base in range(len(boxes)):
+        if not remaining[base]:
+            continue
+        cluster = np.flatnonzero(remaining & iou[base])
+        remaining[cluster] = False
+        # argmax returns the first of equal areas, like max() did
+        kept.append(cluster[np.argmax(areas[cluster])])
+    return np.array(kept, dtype=np.int64), boxes[kept]
+
+# Function to fuse the boxes of one image and class with weighted boxes fusion
+def weighted_boxes_fusion(boxes, iou_threshold=0.5, scores=None, iou=None):
+    """
+    WBF as in ensemble_boxes: boxes are visited by descending score and join
+    the fused box they overlap most (IoU above the threshold), which becomes
+    the score-weighted mean of its members. Without scores every box weighs
+    the same. Returns the index of the first member of each fused box and
+    the fused boxes.
+    """
+    scores = np.ones(len(boxes)) if scores is None else np.asarray(scores, dtype=np.float64)
+    # Equal scores are visited last box first, as ensemble_boxes does
+    order = np.argsort(scores, kind="stable")[::-1]
+    fused = np.empty((0, 4))
+    weighted_sums = []
+    weights = []
+    first_members = []
+    for index in order:
+        box, score = boxes[index], scores[index]
+        match = -1
+        if len(fused):
+            overlaps = iou_matrix(box[None], fused)[0]
+            best = int(np.argmax(overlaps))
+            if overlaps[best] > iou_threshold:
+                match = best
+        if match < 0:
+            weighted_sums.append(box * score)
+            weights.append(score)
+            first_members.append(index)
+            fused = np.vstack([fused, box])
+        else:
+            weighted_sums[match] = weighted_sums[match] + box * score
+            weights[match] += score
+            fused[match] = weighted_sums[match] / weights[match]
+    return np.array(first_members, dtype=np.int64), fused
+
+FUSION_METHODS = {
+    "largest": keep_largest,
+    "wbf": weighted_boxes_fusion,
+}
+
+# -------------------- Annotations --------------------
+
+# Function to fuse the boxes of every image and class of an annotation table
+def fuse_annotations(df, iou_threshold=0.5, method="largest", by=("image_id", "class_name"), score_column=None):
+    """
+    Vectorized grouping_annotations: rows without boxes (e.g. "No finding")
+    are dropped and each (image, class) group is fused with FUSION_METHODS[method].
+    Groups come out sorted by their keys with the fused boxes in input order,
+    as df.groupby did. Groups in which no two boxes reach the threshold are
+    kept as they are, and with the "largest" rule a group in which every pair
+    does collapses to its largest box, without a per-group loop.
+    """
+    fuse = FUSION_METHODS[method]
+    by = list(by)
+    df = df.dropna(subset=BOX_COLUMNS)
+    # One stable sort puts every group in a contiguous run, keeping the row order inside it
+    df = df.sort_values(by, kind="stable")
+    boxes = df[BOX_COLUMNS].to_numpy(dtype=np.float64)
+    scores = df[score_column].to_numpy(dtype=np.float64) if score_column else None
+
+    keys = df[by]
+    key_values = keys.to_numpy()
+    # Groups start wherever any key differs from the previous row
+    changed = (key_values[1:] != key_values[:-1]).any(axis=1)
+    starts = np.flatnonzero(np.r_[len(df) > 0, changed])
+    sizes = np.diff(np.r_[starts, len(df)])
+
+    ious = grouped_iou(boxes, starts, sizes)
+    matrix_offsets = np.cumsum(sizes ** 2) - sizes ** 2
+    # Pairs reaching the threshold per group, not counting each box with itself
+    reached = ious >= iou_threshold
+    local = np.arange(len(boxes)) - np.repeat(starts, sizes)
+    reached[np.repeat(matrix_offsets, sizes) + local * np.repeat(sizes, sizes) + local] = False
+    overlaps = np.add.reduceat(reached, matrix_offsets) if len(reached) else np.zeros(0, dtype=np.int64)
+
+    # Every box of a group without overlaps is kept as is
+    keep = np.repeat(overlaps == 0, sizes)
+    kept_rows = [np.flatnonzero(keep)]
+    fused_boxes = [boxes[keep]]
+    if method == "largest":
+        # A group where every pair overlaps is one cluster: its first largest box
+        clique = overlaps == sizes * (sizes - 1)
+        clique &= overlaps > 0
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        largest = [start + np.argmax(areas[start:start + size]) for start, size in zip(starts[clique], sizes[clique])]
+        kept_rows.append(np.array(largest, dtype=np.int64))
+        fused_boxes.append(boxes[kept_rows[-1]])
+        partial = ~clique & (overlaps > 0)
+    else:
+        partial = overlaps > 0
+
+    # The rest is walked box by box
+    for start, size, offset in zip(starts[partial], sizes[partial], matrix_offsets[partial]):
+        group_scores = scores[start:start + size] if scores is not None else None
+        group_iou = ious[offset:offset + size * size].reshape(size, size)
+        kept, group_boxes = fuse(boxes[start:start + size], iou_threshold, group_scores, group_iou)
+        kept_rows.append(kept + start)
+        fused_boxes.append(group_boxes)
+
+    kept_rows = np.concatenate(kept_rows)
+    if not len(kept_rows):
+        return pd.DataFrame(columns=by + BOX_COLUMNS)
+    # Back to group order, then to the order of the rule inside each group
+    group_ids = np.repeat(np.arange(len(starts)), sizes)
+    order = np.lexsort((np.arange(len(kept_rows)), group_ids[kept_rows]))
+    fused = keys.iloc[kept_rows[order]].reset_index(drop=True)
+    fused[BOX_COLUMNS] = np.concatenate(fused_boxes)[order]
+    return fused
+
+# Function to fuse the boxes and keep the unanimous "No finding" images, as process_annotations
+def process_annotations(df, iou_threshold=0.5, method="largest", no_finding_readers=3):
+    fused_data = fuse_annotations(df, iou_threshold=iou_threshold, method=method)
+
+    # For training annotations, handle "No finding" separately: keep one row
+    # per image every radiologist marked as "No finding" and nothing was fused on
+    if "rad_id" in df.columns:
+        no_finding = df[df["class_name"] == "No finding"]
+        counts = no_finding["image_id"].value_counts()
+        unanimous = counts.index[counts == no_finding_readers]
+        missing_rows = no_finding[
+            no_finding["image_id"].isin(unanimous) & ~no_finding["image_id"].isin(fused_data["image_id"])
+        ].drop_duplicates(subset="image_id")
+        fused_data = pd.concat([fused_data, missing_rows], ignore_index=True)
+
+    return fused_data
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pandas as pd
+import pydicom
+
+# Streaming version of dicom_to_png.ipynb + resize_images.ipynb + the YOLO label
+# export of the YOLOv8 notebooks: every image is decoded, windowed, resized and
+# padded in one pass on a process pool, without the 16-bit PNG intermediate.
+# Finished images are appended to a manifest so an interrupted run resumes
+# where it stopped, and the annotations are rescaled from the manifest at the end.
+#
+#   python preprocess_dataset.py --input train/ --output-dir resized_train_images \
+#       --annotations processed_train_annotations.csv --labels-dir yolo_labels
+
+DICOM_EXTENSIONS = ('.dicom', '.dcm')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg') + DICOM_EXTENSIONS
+MANIFEST_FILE = "manifest.jsonl"
+
+# -------------------- Image Processing --------------------
+
+# Function to read a DICOM file as an 8-bit image, windowed like convert_dicom_to_png
+def read_dicom(dicom_path, window_center=None, window_width=None):
+    pixel_array = pydicom.dcmread(dicom_path).pixel_array.astype(np.float32)
+
+    # Apply windowing if specified
+    if window_center and window_width:
+        min_val = window_center - (window_width / 2)
+        max_val = window_center + (window_width / 2)
+        np.clip(pixel_array, min_val, max_val, out=pixel_array)
+        pixel_array -= min_val
+        pixel_array /= max_val - min_val
+    else:
+        pixel_array /= np.max(pixel_array)
+    pixel_array *= 65535
+
+    # The notebooks wrote a 16-bit PNG that cv2.imread then cut down to its
+    # high byte; do the same here instead of going through the file
+    return (pixel_array.astype(np.uint16) >> 8).astype(np.uint8)
+
+# Function to resize an image to fit target_size and pad it to a square, as resize_images_and_update_annotations
+def letterbox(img, target_size):
+    """Returns (padded image, scale, x_offset, y_offset)"""
+    original_height, original_width = img.shape[:2]
+
+    # Calculate scaling factors
+    scale = min(target_size / original_width, target_size / original_height)
+    new_width = int(original_width * scale)
+    new_height = int(original_height * scale)
+
+    # Resize image
+    resized_img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    # Pad around it
+    x_offset = (target_size - new_width) // 2
+    y_offset = (target_size - new_height) // 2
+    padded_img = cv2.copyMakeBorder(
+        resized_img, y_offset, target_size - new_height - y_offset,
+        x_offset, target_size - new_width - x_offset, cv2.BORDER_CONSTANT, value=0)
+    return padded_img, scale, x_offset, y_offset
+
+# Function to convert one image and return its manifest entry
+def process_image(task):
+    source, output_path, target_size, window_center, window_width = task
+    try:
+        if source.lower().endswith(DICOM_EXTENSIONS):
+            img = read_dicom(source, window_center, window_width)
+        else:
+            img = cv2.imread(source, cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                raise ValueError("could not read image")
+        padded_img, scale, x_offset, y_offset = letterbox(img, target_size)
+
+        # X-rays are grayscale, so one channel is written; cv2.imread (and so
+        # YOLO's loader) still reads it back as three identical channels.
+        # Write to a temporary name so an interrupted run never leaves a partial file
+        temp_path = output_path + ".tmp.png"
+        cv2.imwrite(temp_path, padded_img)
+        os.replace(temp_path, output_path)
+    except Exception as e:
+        return {"source": source, "error": str(e)}
+
+    return {
+        "source": source,
+        "image_id": os.path.basename(output_path),
+        "width": img.shape[1],
+        "height": img.shape[0],
+        "scale": scale,
+        "x_offset": x_offset,
+        "y_offset": y_offset,
+    }
+
+# -------------------- Manifest --------------------
+
+# Function to list input images in one directory scan
+def list_images(input_dir):
+    images = []
+    for entry in os.scandir(input_dir):
+        if entry.is_dir():
+            images.extend(list_images(entry.path))
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            images.append(entry.path)
+    return sorted(images)
+
+# Function to load the finished entries of a previous run
+def load_manifest(manifest_path, output_dir):
+    finished = {}
+    if not os.path.exists(manifest_path):
+        return finished
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:  # last line of an interrupted run
+                continue
+            # Outputs removed since then are redone
+            if os.path.exists(os.path.join(output_dir, entry["image_id"])):
+                finished[entry["source"]] = entry
+    return finished
+
+# -------------------- Annotations --------------------
+
+# Function to rescale the annotations of every processed image to the resized images
+def rescale_annotations(annotations, manifest):
+    """
+    Same result as resize_images_and_update_annotations: image_id becomes the
+    resized file name and the boxes are moved into the padded image. Boxes
+    that are missing (e.g. "No finding") stay missing.
+    """
+    geometry = pd.DataFrame(manifest)[["image_id", "scale", "x_offset", "y_offset"]]
+    geometry["key"] = geometry["image_id"].str.rsplit(".", n=1).str[0]
+    annotations = annotations.assign(key=annotations["image_id"].astype(str)).merge(
+        geometry.rename(columns={"image_id": "resized_id"}), on="key", how="inner")
+    for column, offset in (("x_min", "x_offset"), ("y_min", "y_offset"), ("x_max", "x_offset"), ("y_max", "y_offset")):
+        # Truncate like int() did, keeping missing boxes as NaN
+        annotations[column] = np.trunc(annotations[column] * annotations["scale"] + annotations[offset]).astype("Int64")
+    annotations["image_id"] = annotations["resized_id"]
+    return annotations[["image_id", "class_name", "x_min", "y_min", "x_max", "y_max", "class_id"]]
+
+# Function to write one YOLO label file per image, as convert_to_yolo_format
+def write_yolo_labels(annotations, labels_dir, target_size):
+    os.makedirs(labels_dir, exist_ok=True)
+    boxes = annotations.dropna(subset=["x_min", "y_min", "x_max", "y_max"])
+    lines = (
+        boxes["class_id"].astype(int).astype(str) + " "
+        + ((boxes["x_min"] + boxes["x_max"]) / 2 / target_size).astype(str) + " "
+        + ((boxes["y_min"] + boxes["y_max"]) / 2 / target_size).astype(str) + " "
+        + ((boxes["x_max"] - boxes["x_min"]) / target_size).astype(str) + " "
+        + ((boxes["y_max"] - boxes["y_min"]) / target_size).astype(str)
+    )
+    labels = lines.groupby(boxes["image_id"]).agg("\n".join)
+    # Images without boxes get an empty label file, like the notebooks
+    for image_id in annotations["image_id"].unique():
+        label_file = os.path.join(labels_dir, f"{os.path.splitext(image_id)[0]}.txt")
+        with open(label_file, 'w') as f:
+            f.write(labels.get(image_id, ""))
+    return len(labels)
+
+# -------------------- CLI --------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert, resize and label a VinDr-CXR split for YOLO training')
+    parser.add_argument('--input', type=str, required=True, help='Directory of DICOM (or already converted PNG/JPEG) images')
+    parser.add_argument('--output-dir', type=str, required=True, help='Directory for the resized PNGs and the manifest')
+    parser.add_argument('--target-size', type=int, default=1024, help='Side of the square output images')
+    parser.add_argument('--window-center', type=float, default=None, help='DICOM window center (default: scale by the image maximum)')
+    parser.add_argument('--window-width', type=float, default=None, help='DICOM window width')
+    parser.add_argument('--annotations', type=str, default='', help='Processed annotations CSV (from process_images.ipynb) to rescale')
+    parser.add_argument('--annotations-output', type=str, default='', help='Where to save the rescaled annotations (default: resized_annotations.csv in --output-dir)')
+    parser.add_argument('--labels-dir', type=str, default='', help='Write YOLO label files here')
+    parser.add_argument('--exclude-class', type=str, nargs='*', default=[], help='Classes left out of the YOLO labels (e.g. "No finding" for the train split)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=8, help='Images handed to a worker at a time')
+    parser.add_argument('--log-every', type=int, default=200, help='Report progress every N images')
+    return parser.parse_args()
+
+# Function to keep each worker's OpenCV on one thread, the pool provides the parallelism
+def init_worker():
+    cv2.setNumThreads(1)
+
+def main():
+    args = parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = os.path.join(args.output_dir, MANIFEST_FILE)
+
+    sources = list_images(args.input)
+    finished = load_manifest(manifest_path, args.output_dir)
+    tasks = [
+        (source, os.path.join(args.output_dir, f"{os.path.splitext(os.path.basename(source))[0]}.png"),
+         args.target_size, args.window_center, args.window_width)
+        for source in sources if source not in finished
+    ]
+    print(f"{len(sources)} images, {len(finished)} already done, {len(tasks)} to process")
+
+    processed = failed = 0
+    started = time.perf_counter()
+    with open(manifest_path, 'a') as manifest, \
+            ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=init_worker) as pool:
+        for entry in pool.map(process_image, tasks, chunksize=max(1, args.chunk_size)):
+            if "error" in entry:
+                failed += 1
+                print(f"Failed to convert {entry['source']}: {entry['error']}", file=sys.stderr)
+                continue
+            # Flushed line by line: the manifest is what an interrupted run resumes from
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            finished[entry["source"]] = entry
+            processed += 1
+            if processed % args.log_every == 0:
+                elapsed = time.perf_counter() - started
+                print(f"processed {processed}/{len(tasks)} ({processed / elapsed:.1f} img/s)")
+    elapsed = time.perf_counter() - started
+    report = {
+        "processed": processed,
+        "skipped": len(sources) - len(tasks),
+        "failed": failed,
+        "seconds": round(elapsed, 2),
+        "images_per_second": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+    if args.annotations and finished:
+        annotations = rescale_annotations(pd.read_csv(args.annotations), list(finished.values()))
+        annotations_output = args.annotations_output or os.path.join(args.output_dir, "resized_annotations.csv")
+        annotations.to_csv(annotations_output, index=False)
+        report["annotations"] = len(annotations)
+        if args.labels_dir:
+            labelled = annotations[~annotations["class_name"].isin(args.exclude_class)]
+            report["label_files"] = labelled["image_id"].nunique()
+            report["images_with_boxes"] = write_yolo_labels(labelled, args.labels_dir, args.target_size)
+
+    print(json.dumps(report, indent=2))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())